@@ -0,0 +1,132 @@
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeCheckerServer(ThreadingHTTPServer):
+    """Local stand-in for the remote proxyip checker.
+
+    GET /check?ip=..&port=.. answers {"proxyip": true|false} after `latency`
+    seconds (plus up to `jitter`), or a 500 with probability `error_rate`.
+    POST /check with a JSON list of {"ip", "port"} answers a list of such
+    replies in one round trip, or a 405 when `batch` is False (a checker
+    without batch support). Whether an endpoint is alive is a stable hash of
+    ip:port, so repeated runs agree. GET /files/<name> serves files from
+    `files_dir`."""
+
+    daemon_threads = True
+    request_queue_size = 4096
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0,
+                 error_rate=0.0, alive_ratio=0.5, files_dir=None, batch=True):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.alive_ratio = alive_ratio
+        self.files_dir = files_dir
+        self.batch = batch
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url_template(self):
+        return self.base_url + "/check?ip={ip}&host=speed.cloudflare.com&port={port}&tls=true"
+
+    def is_alive(self, ip, port):
+        return zlib.crc32(f"{ip}:{port}".encode()) % 1000 < self.alive_ratio * 1000
+
+    def reply(self, ip, port):
+        return {'proxyip': self.is_alive(ip, port), 'ip': ip, 'port': port}
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        url = urlparse(self.path)
+
+        if url.path.startswith('/files/') and server.files_dir:
+            path = os.path.join(server.files_dir, os.path.basename(url.path))
+            if not os.path.isfile(path):
+                return self._send(404)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.end_headers()
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile)
+            return
+
+        if url.path != '/check':
+            return self._send(404)
+
+        if self._delay_or_fail():
+            return
+
+        query = parse_qs(url.query)
+        ip = query.get('ip', [''])[0]
+        port = query.get('port', [''])[0]
+        self._send(200, json.dumps(server.reply(ip, port)).encode())
+
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        payload = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if urlparse(self.path).path != '/check':
+            return self._send(404)
+        if not server.batch:
+            return self._send(405, b'Method Not Allowed', 'text/plain')
+        try:
+            items = json.loads(payload)
+        except ValueError:
+            return self._send(400, b'Bad Request', 'text/plain')
+        if not isinstance(items, list):
+            return self._send(400, b'Bad Request', 'text/plain')
+
+        # one round trip for the whole batch
+        if self._delay_or_fail():
+            return
+        replies = [server.reply(str(item.get('ip', '')), str(item.get('port', '')))
+                   for item in items if isinstance(item, dict)]
+        self._send(200, json.dumps(replies).encode())
+
+    def _delay_or_fail(self):
+        server = self.server
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(500, b'Internal Server Error', 'text/plain')
+            return True
+        return False
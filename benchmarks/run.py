@@ -0,0 +1,242 @@
+"""Benchmarks for the hot path of each script.
+
+    python -m benchmarks.run                      # all cases, default sizes
+    python -m benchmarks.run --sizes 1000,100000 --check-sizes 1000 \
+        --latency 0.05 --error-rate 0.01 --engine async
+
+Every case runs in its own interpreter so peak RSS is per case. Results are
+written to benchmarks/results/<timestamp>.json for comparison over time.
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks import synthetic
+from benchmarks.fake_checker import FakeCheckerServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+CASES = ['update_proxy_status', 'krlist', 'convert_proxies', 'cfproxyip']
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def peak_rss_kb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _timed_calls(module, name, samples):
+    original = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    async def async_wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    setattr(module, name, async_wrapper if inspect.iscoroutinefunction(original) else wrapper)
+
+
+def bench_update_proxy_status(args, files, size):
+    import csv
+    import update_proxy_status
+
+    with open(files['csv'], encoding='utf-8') as f:
+        rows = [row for row in csv.reader(f) if len(row) >= 4]
+    samples = []
+    # per-check latency as seen by the engine's worker
+    _timed_calls(update_proxy_status, 'check_proxy_async' if args.engine == 'async' else 'check_proxy', samples)
+    start = time.perf_counter()
+    results = update_proxy_status.run_checks(rows, args.api_url, 'api', args.engine, args.concurrency)
+    elapsed = time.perf_counter() - start
+    return {'items': len(results), 'elapsed_s': elapsed, 'latencies': samples}
+
+
+def bench_krlist(args, files, size):
+    import krlist
+
+    outdir = tempfile.mkdtemp(prefix='krlist-')
+    outputs = {cc: os.path.join(outdir, f"{cc.lower()}list.txt") for cc in ['KR', 'HK', 'JP', 'SG', 'TW']}
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        counts = krlist.process_proxy_list_to_files(
+            args.base_url + '/files/' + os.path.basename(files['csv']), outputs,
+            fixed_entries={'HK': krlist.FIXED_HK_HOSTS})
+        samples.append(time.perf_counter() - start)
+    shutil.rmtree(outdir, ignore_errors=True)
+    return {'items': size, 'elapsed_s': sum(samples) / len(samples), 'latencies': samples,
+            'routed': sum(counts.values())}
+
+
+def bench_convert_proxies(args, files, size):
+    import convert_proxies
+
+    with open(files['hash_list'], encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for line in lines:
+            convert_proxies._process_single_line(line)
+        samples.append(time.perf_counter() - start)
+    return {'items': size, 'elapsed_s': sum(samples) / len(samples), 'latencies': samples}
+
+
+def bench_cfproxyip(args, files, size):
+    import cfproxyip
+
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        extracted = cfproxyip.extract_ip_port_country_code_yaml(
+            args.base_url + '/files/' + os.path.basename(files['yaml']))
+        samples.append(time.perf_counter() - start)
+    return {'items': size, 'elapsed_s': sum(samples) / len(samples), 'latencies': samples,
+            'extracted': len(extracted)}
+
+
+BENCHMARKS = {
+    'update_proxy_status': bench_update_proxy_status,
+    'krlist': bench_krlist,
+    'convert_proxies': bench_convert_proxies,
+    'cfproxyip': bench_cfproxyip,
+}
+
+
+def run_case(args):
+    """Child-process side: run one case and print a JSON line."""
+    sys.path.insert(0, ROOT)
+    files = json.loads(args.files)
+    with contextlib.redirect_stdout(io.StringIO()):
+        raw = BENCHMARKS[args.case](args, files, args.size)
+    latencies = raw.pop('latencies')
+    result = {
+        'case': args.case,
+        'size': args.size,
+        'throughput_per_s': raw['items'] / raw['elapsed_s'] if raw['elapsed_s'] else None,
+        'p50_ms': (percentile(latencies, 0.50) or 0) * 1000,
+        'p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+    result.update(raw)
+    print(json.dumps(result))
+
+
+def generate_inputs(workdir, size):
+    return {
+        'csv': synthetic.write_csv(os.path.join(workdir, f"rows-{size}.csv"), size),
+        'hash_list': synthetic.write_hash_list(os.path.join(workdir, f"hash-{size}.txt"), size),
+        'yaml': synthetic.write_clash_yaml(os.path.join(workdir, f"clash-{size}.yaml"), size),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=','.join(CASES))
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='input sizes for the parse/split benchmarks')
+    parser.add_argument('--check-sizes', default='1000,10000',
+                        help='input sizes for the checker benchmark (one HTTP request per row)')
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread')
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in checker latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 500 responses')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions for the parse benchmarks')
+    parser.add_argument('--output', default=None, help='result file (default benchmarks/results/<ts>.json)')
+    # internal: run a single case in a child process
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--files', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        return run_case(args)
+
+    cases = [c for c in args.cases.split(',') if c]
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    check_sizes = [int(s) for s in args.check_sizes.split(',') if s]
+
+    workdir = tempfile.mkdtemp(prefix='proxy-bench-')
+    server = FakeCheckerServer(latency=args.latency, jitter=args.jitter,
+                               error_rate=args.error_rate, files_dir=workdir).start()
+    results = []
+    try:
+        for size in sorted(set(sizes + check_sizes)):
+            files = generate_inputs(workdir, size)
+            for case in cases:
+                if size not in (check_sizes if case == 'update_proxy_status' else sizes):
+                    continue
+                cmd = [sys.executable, '-m', 'benchmarks.run', '--case', case, '--size', str(size),
+                       '--files', json.dumps(files), '--base-url', server.base_url,
+                       '--api-url', server.api_url_template, '--engine', args.engine,
+                       '--repeat', str(args.repeat)]
+                if args.concurrency:
+                    cmd += ['--concurrency', str(args.concurrency)]
+                # hermetic: relative caches (.cache/http, .cache/dns.json, ...) land in a scratch
+                # directory, and the fixed CDN hosts are kept as listed instead of resolved
+                scratch = tempfile.mkdtemp(prefix=f"{case}-", dir=workdir)
+                env = dict(os.environ, FIXED_HOST_POLICY='keep',
+                           PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+                proc = subprocess.run(cmd, cwd=scratch, env=env, capture_output=True, text=True)
+                if proc.returncode != 0:
+                    print(f"{case} @ {size}: FAILED\n{proc.stderr}", file=sys.stderr)
+                    continue
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+                results.append(result)
+                print(f"{case:>20} {size:>9}  {result['throughput_per_s']:>12.1f}/s  "
+                      f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                      f"rss {result['peak_rss_kb'] / 1024:7.1f} MiB")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'engine': args.engine, 'concurrency': args.concurrency, 'latency': args.latency,
+                     'jitter': args.jitter, 'error_rate': args.error_rate, 'repeat': args.repeat},
+        'results': results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import random
+
+COUNTRIES = ['US', 'KR', 'HK', 'JP', 'SG', 'TW', 'DE', 'GB', 'NL', 'AU', 'VN', 'ID']
+PROVIDERS = ['Oracle Cloud', 'Digital Ocean', 'Tencent cloud computing', 'Baxet Group Inc.',
+             'IT7 Networks Inc', 'Contabo Asia Private', 'Ucloud Information Technology Hk']
+PORTS = [443, 2053, 2083, 2087, 2096, 8443, 587, 50000]
+NAME_PREFIXES = ['🇺🇸US', 'HKG', 'JP', 'SG', 'KR', 'TW', 'CF']
+
+
+def _rows(count, seed):
+    rng = random.Random(seed)
+    # clustered like the real lists: a few hosts per provider /24
+    for i in range(count):
+        net = rng.randrange(1 << 24)
+        ip = f"{(net >> 16) % 223 + 1}.{(net >> 8) & 255}.{net & 255}.{rng.randrange(1, 255)}"
+        port = rng.choice(PORTS) if i % 3 else rng.randrange(1024, 65535)
+        yield ip, port, rng.choice(COUNTRIES), rng.choice(PROVIDERS)
+
+
+def write_csv(path, count, seed=0):
+    """ip,port,country,name rows as in ip.txt / proxy.txt / update_proxyip.txt."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for ip, port, country, provider in _rows(count, seed):
+            f.write(f"{ip},{port},{country},{provider}\n")
+    return path
+
+
+def write_hash_list(path, count, seed=0):
+    """ip:port#CC lines as consumed by convert_proxies."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for ip, port, country, _ in _rows(count, seed):
+            f.write(f"{ip}:{port}#{country}\n")
+    return path
+
+
+def write_clash_yaml(path, count, seed=0):
+    """Clash subscription with a top-level proxies: sequence, written without
+    PyYAML so that 1M-entry files can be generated in bounded memory."""
+    rng = random.Random(seed + 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("port: 7890\nmode: rule\nproxies:\n")
+        for i, (ip, port, _, _) in enumerate(_rows(count, seed)):
+            name = f"{rng.choice(NAME_PREFIXES)}-{i}"
+            f.write(f"  - {{name: \"{name}\", server: {ip}, port: {port}, type: trojan, "
+                    f"password: aaa, sni: aaa, network: ws, "
+                    f"ws-opts: {{path: /proxyip, headers: {{Host: aaaa}}}}}}\n")
+        f.write("rules:\n  - MATCH,DIRECT\n")
+    return path
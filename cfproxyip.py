@@ -1,7 +1,17 @@
+import io
+import os
 import re
 import requests
 import yaml # YAML 파서 라이브러리 (pip install pyyaml 필요)
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from fetch_cache import fetch
+from geo_index import get_index
+from proxy_index import IndexEntry, ProxyIndex, use_index
+from proxy_record import ProxyRecord, ip_to_int
+from render_formats import OutputNode, decode_subscription, format_path, parse_formats, render_outputs
 
 # 국가 코드 -> 한국어 국가명 매핑
 # (기존 맵을 그대로 사용)
@@ -40,75 +50,197 @@ def get_korean_country_name(country_code: str) -> str:
     return code_upper
 
 
-def extract_ip_port_country_code_yaml(url: str) -> List[str]:
+# 가능하면 libyaml 기반 C 로더를 사용하고, 없으면 순수 파이썬 로더로 대체합니다.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# 따옴표 없는 스칼라 중 null / 정수로 해석할 값 (port 등)
+_YAML_NULL_VALUES = {'', '~', 'null', 'Null', 'NULL'}
+_YAML_INT_PATTERN = re.compile(r'^[-+]?[0-9]+$')
+
+
+def _read_yaml_node(loader) -> Any:
+    """이벤트 스트림에서 노드 하나(스칼라/매핑/시퀀스)를 읽어 파이썬 값으로 만듭니다."""
+    event = loader.get_event()
+
+    if isinstance(event, yaml.ScalarEvent):
+        # plain 스칼라만 null / 정수로 해석하고, 따옴표가 있는 값은 문자열로 유지합니다.
+        if event.implicit[0]:
+            if event.value in _YAML_NULL_VALUES:
+                return None
+            if _YAML_INT_PATTERN.match(event.value):
+                return int(event.value)
+        return event.value
+
+    if isinstance(event, yaml.MappingStartEvent):
+        mapping: Dict[Any, Any] = {}
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _read_yaml_node(loader)
+            mapping[key] = _read_yaml_node(loader)
+        loader.get_event()
+        return mapping
+
+    if isinstance(event, yaml.SequenceStartEvent):
+        sequence: List[Any] = []
+        while not loader.check_event(yaml.SequenceEndEvent):
+            sequence.append(_read_yaml_node(loader))
+        loader.get_event()
+        return sequence
+
+    # 앵커 참조(AliasEvent) 등은 프록시 목록에서 사용하지 않으므로 무시합니다.
+    return None
+
+
+def iter_yaml_proxies(stream) -> Iterator[Dict[str, Any]]:
     """
-    URL에서 YAML 데이터를 가져와 PyYAML 파서로 파싱 후, 
-    프록시 목록에서 IP, Port, 국가 코드를 추출하고 정렬하여 반환합니다.
+    YAML 스트림에서 최상위 'proxies:' 시퀀스를 찾아 항목을 하나씩 반환합니다.
+    문서 전체를 메모리에 올리지 않고 이벤트 단위로 순회합니다.
+
+    Raises:
+        KeyError: 최상위 매핑에 'proxies' 키가 없는 경우.
     """
-    extracted_data: List[Dict[str, Any]] = []
-    
+    loader = YAML_LOADER(stream)
+    found = False
+    try:
+        # 최상위 매핑 시작 지점까지 이동 (StreamStart, DocumentStart 건너뜀)
+        while not loader.check_event(yaml.MappingStartEvent):
+            if loader.check_event(yaml.StreamEndEvent):
+                raise KeyError('proxies')
+            loader.get_event()
+        loader.get_event()
+
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _read_yaml_node(loader)
+            if key == 'proxies' and loader.check_event(yaml.SequenceStartEvent):
+                found = True
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    proxy = _read_yaml_node(loader)
+                    if isinstance(proxy, dict):
+                        yield proxy
+                loader.get_event()
+            else:
+                # rules, proxy-groups 등 다른 키의 값은 읽고 버립니다.
+                _read_yaml_node(loader)
+    finally:
+        loader.dispose()
+
+    if not found:
+        raise KeyError('proxies')
+
+
+def _proxy_record(proxy: Dict[str, Any], geo) -> Optional[ProxyRecord]:
+    """
+    프록시 항목 하나를 국가 코드와 한국어 국가명을 레이블로 가진 레코드로 변환합니다.
+    국가 코드는 로컬 IP 대역 데이터(geo_index)에서 찾고, 데이터가 없거나 찾지 못하면 이름에서 추정합니다.
+    """
+    # 필요한 키가 모두 있는지 확인
+    server = proxy.get('server')
+    port = proxy.get('port')
+    name = proxy.get('name') or ''
+
+    if not server or not port or not str(port).isdigit():
+        return None
+
+    # IP 주소 형식이 잘못된 경우 (예: 도메인 이름) 건너뜀
+    ip_key = ip_to_int(str(server))
+    if ip_key is None:
+        return None
+
+    # 이름에서 국가 코드 추출 시도
+    match = NAME_COUNTRY_PATTERN.search(str(name))
+    raw_country_code = match.group('country_code').upper() if match else 'N/A'
+
+    # 'CF' 표기(아래 특수 처리)가 아니면 IP 대역 기준 국가 코드를 우선 사용
+    if geo is not None and raw_country_code != 'CF':
+        raw_country_code = geo.lookup_int(ip_key) or raw_country_code
+
+    # 한국어 국가명 가져오기
+    korean_name = get_korean_country_name(raw_country_code)
+
+    # --- 사용자 요청에 따른 특정 국가 코드 처리 ---
+    if raw_country_code == 'CF':
+        raw_country_code = 'HK' # 국가 코드 변경
+        korean_name = 'SPEED'   # 한국어 국가명 변경
+    # ---------------------------------------------
+
+    return ProxyRecord(ip_key, int(port), raw_country_code, korean_name)
+
+
+def _entry_node(entry: IndexEntry, country_code: str, korean_name: str) -> OutputNode:
+    """인덱스 항목을 'ip:port#CC 국가명 port' 노드로 변환"""
+    return OutputNode(entry.endpoint, f"{country_code} {korean_name} {entry.port}")
+
+
+def _format_entry(entry: IndexEntry, country_code: str, korean_name: str) -> str:
+    """인덱스 항목을 'ip:port#CC 국가명 port' 형식으로 출력"""
+    return _entry_node(entry, country_code, korean_name).text
+
+
+def extract_ip_port_country_code_from_proxies(proxies: Iterable[Dict[str, Any]],
+                                              index: Optional[ProxyIndex] = None,
+                                              source: str = 'proxies') -> List[str]:
+    """
+    프록시 항목들에서 IP, Port, 국가 코드를 추출하여 인덱스에 병합하고 (완전히 같은 항목은 한 번만)
+    IP 주소(32비트 정수 키) 기준으로 정렬된 출력 줄을 반환합니다. 같은 IP는 입력 순서를 유지합니다.
+
+    Args:
+        proxies: Clash 'proxies:' 항목들.
+        index: 병합할 인덱스 (없으면 이 호출에서만 쓰는 인덱스를 만듭니다).
+        source: 인덱스에 기록할 출처 이름.
+    """
+    if index is None:
+        index = ProxyIndex()
+    geo = get_index()
+    stage_metrics = metrics.current()
+    processed = 0
+    with stage_metrics.timer('parse'):
+        records = []
+        for proxy in proxies:
+            processed += 1
+            record = _proxy_record(proxy, geo)
+            if record is not None:
+                records.append(record)
+        stage_metrics.add('rows_processed', processed)
+        stage_metrics.add('rows_merged', index.merge(source, records))
+    return index.render_lines(source, _format_entry, order='ip')
+
+
+def extract_ip_port_country_code_yaml(url: str, skip_if_unchanged: bool = False, session=None,
+                                      index: Optional[ProxyIndex] = None,
+                                      source: Optional[str] = None) -> Optional[List[str]]:
+    """
+    URL에서 YAML 데이터를 조건부 요청으로 받아 디스크 캐시에 스트리밍 저장한 뒤,
+    'proxies:' 시퀀스를 항목 단위로 순회하며 IP, Port, 국가 코드를 추출하고 정렬하여 반환합니다.
+    (응답 본문 전체나 YAML 문서 전체를 메모리에 올리지 않습니다.)
+
+    Args:
+        url: 구독(YAML) URL.
+        skip_if_unchanged: True이면 내용이 이전 실행과 같을 때(304 또는 같은 해시) 파싱하지 않고 None을 반환합니다.
+        session: 재사용할 requests.Session (파이프라인에서 공유).
+        index: 병합할 인덱스.
+        source: 인덱스에 기록할 출처 이름 (없으면 url).
+    """
+    source = source or url
     try:
-        # 1. 데이터 다운로드
-        response = requests.get(
+        # 1. 데이터 다운로드 (ETag/Last-Modified 조건부 요청, 스트리밍 저장)
+        fetched = fetch(
             url, 
+            session=session,
             timeout=20, # 타임아웃을 20초로 늘려 안정성 확보
             headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
         )
-        response.raise_for_status() # HTTP 오류 발생 시 예외 처리
-        
-        # 2. YAML 파싱
-        config_data = yaml.safe_load(response.text)
-        
-        if not isinstance(config_data, dict) or 'proxies' not in config_data:
-            print("오류: 다운로드된 콘텐츠가 유효한 YAML 형식이거나 'proxies' 키를 포함하지 않습니다.")
-            return []
-            
-        # 3. 프록시 목록 순회 및 추출
-        for proxy in config_data['proxies']:
-            # 필요한 키가 모두 있는지 확인
-            server = proxy.get('server')
-            port = proxy.get('port')
-            name = proxy.get('name', '')
-            
-            if not server or not port:
-                continue
-            
-            # 이름에서 국가 코드 추출 시도
-            match = NAME_COUNTRY_PATTERN.search(name)
-            raw_country_code = match.group('country_code').upper() if match else 'N/A'
-            
-            # 한국어 국가명 가져오기
-            korean_name = get_korean_country_name(raw_country_code)
-
-            # --- 사용자 요청에 따른 특정 국가 코드 처리 ---
-            if raw_country_code == 'CF':
-                raw_country_code = 'HK' # 국가 코드 변경
-                korean_name = 'SPEED'   # 한국어 국가명 변경
-            # ---------------------------------------------
-            
-            # IP 주소 정렬을 위한 숫자 리스트 (try-except로 IP 형식 유효성 검사)
-            try:
-                ip_parts = list(map(int, server.split('.')))
-                if len(ip_parts) != 4:
-                     continue
-            except ValueError:
-                # IP 주소 형식이 잘못된 경우 (예: 도메인 이름) 건너뜀
-                continue 
-            
-            entry = {
-                'ip_parts': ip_parts,
-                'string': f"{server}:{port}#{raw_country_code} {korean_name} {port}"
-            }
-            
-            # 중복 제거
-            if entry['string'] not in [e['string'] for e in extracted_data]:
-                extracted_data.append(entry)
-        
-        # 4. IP 주소 기준 정렬
-        extracted_data.sort(key=lambda x: x['ip_parts'])
-        
-        return [entry['string'] for entry in extracted_data]
-        
+        if skip_if_unchanged and not fetched.changed:
+            if index is not None:
+                index.touch(source)
+            return None
+
+        # 2. YAML 스트리밍 파싱 및 추출
+        with fetched.open('rb') as body:
+            return extract_ip_port_country_code_from_proxies(iter_yaml_proxies(body), index, source=source)
+
+    except KeyError:
+        print("오류: 다운로드된 콘텐츠가 유효한 YAML 형식이거나 'proxies' 키를 포함하지 않습니다.")
+        return []
     except requests.exceptions.RequestException as e:
         print(f"네트워크 오류 또는 타임아웃 발생: {e}")
         return []
@@ -119,19 +251,110 @@ def extract_ip_port_country_code_yaml(url: str) -> List[str]:
         print(f"알 수 없는 오류 발생: {e}")
         return []
 
+def _subscription_proxies(text: str) -> List[Dict[str, Any]]:
+    """구독 본문 하나의 프록시 항목들 (공유 링크 목록이 아니고 Clash YAML이면 YAML로 읽습니다)"""
+    proxies = decode_subscription(text)
+    if not proxies and 'proxies:' in text:
+        proxies = list(iter_yaml_proxies(io.StringIO(text)))
+    return proxies
+
+
+def extract_ip_port_country_code_subscriptions(urls: List[str], skip_if_unchanged: bool = False,
+                                               session=None, index: Optional[ProxyIndex] = None,
+                                               source: str = 'subscriptions') -> Optional[List[str]]:
+    """
+    원본 구독 URL들을 외부 변환 서비스 없이 직접 받아 공유 링크(trojan/vless)를 로컬에서 파싱하고,
+    IP, Port, 국가 코드를 추출하여 인덱스에 병합한 뒤 정렬하여 반환합니다.
+
+    Args:
+        urls: 원본 구독 URL 목록 (base64 공유 링크 구독).
+        skip_if_unchanged: True이면 모든 구독이 이전 실행과 같을 때 파싱하지 않고 None을 반환합니다.
+        session: 재사용할 requests.Session (파이프라인에서 공유).
+        index: 병합할 인덱스.
+        source: 인덱스에 기록할 출처 이름 (모든 구독을 하나의 출처로 병합).
+    """
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    fetched_list = []
+    for url in urls:
+        try:
+            fetched_list.append(fetch(url, session=session, timeout=20, headers=headers))
+        except requests.exceptions.RequestException as e:
+            print(f"구독을 가져오지 못했습니다 ({url}): {e}")
+    if not fetched_list:
+        return []
+    if skip_if_unchanged and len(fetched_list) == len(urls) and not any(f.changed for f in fetched_list):
+        if index is not None:
+            index.touch(source)
+        return None
+
+    proxies: List[Dict[str, Any]] = []
+    try:
+        for fetched in fetched_list:
+            proxies.extend(_subscription_proxies(fetched.text()))
+    except (KeyError, yaml.YAMLError) as e:
+        print(f"구독 내용을 해석하지 못했습니다: {e}")
+        return []
+    if not proxies:
+        return []
+    return extract_ip_port_country_code_from_proxies(proxies, index, source=source)
+
 # URL
 #REAL_TARGET_URL = "https://api.subcsub.com/sub?target=clash&url=https%3A%2F%2Fcm.soso.edu.kg%2Fsub%3Fpassword%3Daaa%26security%3Dtls%26type%3Dws%26host%3Daaaa%26sni%3Daaa%26path%3D%252Fproxyip%253DProxyIP.JP.CMLiussss.Net%26encryption%3Dnone%26allowInsecure%3D1&insert=false&config=https%3A%2F%2Fraw.githubusercontent.com%2Fcmliu%2FACL4SSR%2Fmain%2FClash%2Fconfig%2FACL4SSR_Online.ini&emoji=true&list=true&xudp=false&udp=false&tfo=false&expand=true&scv=false&fdn=false&new_name=true"
 REAL_TARGET_URL = "https://api.subcsub.com/sub?target=clash&url=https%3A%2F%2Fcm.soso.edu.kg%2Fsub%3Fpassword%3Daaa%26security%3Dtls%26type%3Dws%26host%3Daaaa%26sni%3Daaa%26path%3D%252Fproxyip%253DProxyIP.JP.CMLiussss.Net%26encryption%3Dnone%26allowInsecure%3D1%7Chttps%3A%2F%2Fsub.cmliussss.net%2Fsub%3Fpassword%3Daaa%26security%3Dtls%26type%3Dws%26host%3Daaaa%26sni%3Daaa%26path%3D%252Fproxyip%253DProxyIP.JP.CMLiussss.Net%26encryption%3Dnone%26allowInsecure%3D1&insert=false"
-if __name__ == "__main__":
+# 변환 서비스가 가져오는 원본 구독 URL들 (url 파라미터, '|' 구분)
+SUBSCRIPTION_URLS = parse_qs(urlsplit(REAL_TARGET_URL).query)['url'][0].split('|')
+# 구독을 가져오는 방식 (CF_SUBSCRIPTION_MODE 환경 변수)
+# local: 원본 구독을 직접 받아 로컬에서 파싱 (실패하면 converter로 재시도), converter: 변환 서비스의 Clash YAML 사용
+DEFAULT_SUBSCRIPTION_MODE = 'local'
+# 인덱스에 기록할 출처 이름 (두 방식 모두 같은 출처로 병합)
+CFPROXY_SOURCE = 'cfproxyip'
+def main(session=None, index=None):
+    """cfproxy.txt 생성 (pipeline.py에서 공유 세션, 공유 인덱스와 함께 호출할 수 있습니다)"""
     print("프록시 목록 다운로드 및 변환 시작...")
-    extracted_list = extract_ip_port_country_code_yaml(REAL_TARGET_URL)
-
-    # cfproxy.txt 파일로 저장
-    if extracted_list:
-        OUTPUT_FILE = "cfproxy.txt"
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            for item in extracted_list:
-                f.write(item + "\n")
-        print(f"변환 완료: 총 {len(extracted_list)}개의 항목이 {OUTPUT_FILE}에 저장되었습니다.")
+    OUTPUT_FILE = "cfproxy.txt"
+    formats = parse_formats()
+    skip_if_unchanged = all(os.path.exists(format_path(OUTPUT_FILE, fmt)) for fmt in formats)
+    mode = os.getenv('CF_SUBSCRIPTION_MODE', DEFAULT_SUBSCRIPTION_MODE)
+    with use_index(index) as index:
+        extracted_list: Optional[List[str]] = []
+        if mode == 'local':
+            extracted_list = extract_ip_port_country_code_subscriptions(
+                SUBSCRIPTION_URLS, skip_if_unchanged=skip_if_unchanged, session=session,
+                index=index, source=CFPROXY_SOURCE)
+            if extracted_list == []:
+                print("원본 구독에서 항목을 얻지 못해 변환 서비스로 다시 시도합니다.")
+        if extracted_list == []:
+            extracted_list = extract_ip_port_country_code_yaml(
+                REAL_TARGET_URL, skip_if_unchanged=skip_if_unchanged, session=session,
+                index=index, source=CFPROXY_SOURCE)
+
+        if extracted_list is None:
+            if CFPROXY_SOURCE not in index.source_runs:
+                print(f"구독 내용이 변경되지 않아 {OUTPUT_FILE} 갱신을 건너뜁니다.")
+                return
+            # 구독은 그대로지만 검사 결과(지연 시간)가 바뀌었을 수 있으므로 인덱스에서 다시 출력합니다.
+            print(f"구독 내용이 변경되지 않아 저장된 인덱스에서 {OUTPUT_FILE} 파일을 다시 만듭니다.")
+        elif not extracted_list:
+            print("유효한 프록시 항목이 추출되지 않았습니다. 파일이 저장되지 않았습니다.")
+            return
+
+        # 검사 결과에 지연 시간이 있으면 빠른 항목부터 저장 (클라이언트는 앞쪽 항목을 사용)
+        nodes = [_entry_node(*item) for item in index.select(CFPROXY_SOURCE, order='latency')]
+
+    # cfproxy.txt (및 RENDER_FORMATS의 다른 형식) 파일로 저장
+    if nodes:
+        with metrics.current().timer('write'):
+            written = render_outputs(nodes, OUTPUT_FILE, formats)
+        for fmt, was_written in written.items():
+            path = format_path(OUTPUT_FILE, fmt)
+            if was_written:
+                print(f"변환 완료: 총 {len(nodes)}개의 항목이 {path}에 저장되었습니다.")
+            else:
+                print(f"변환 완료: 내용이 같아 {path} 파일을 다시 쓰지 않았습니다.")
     else:
         print("유효한 프록시 항목이 추출되지 않았습니다. 파일이 저장되지 않았습니다.")
+
+if __name__ == "__main__":
+    with metrics.stage('cfproxyip'):
+        main()
+    metrics.write_summary()
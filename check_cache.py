@@ -0,0 +1,85 @@
+import sqlite3
+import time
+
+# default TTLs in seconds: alive results are re-verified every other 6h run,
+# dead results are trusted longer, checker errors are never trusted.
+DEFAULT_TTL = 12 * 3600
+DEFAULT_NEGATIVE_TTL = 24 * 3600
+
+
+class CheckCache:
+    """On-disk cache of the last check outcome (status and latency) per ip:port,
+    backed by SQLite. The output line is not cached: labels come from the
+    current input row."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checks ("
+            " endpoint TEXT PRIMARY KEY,"
+            " status INTEGER,"  # 1 alive, 0 dead, NULL checker error
+            " checked_at REAL NOT NULL,"
+            " error TEXT,"
+            " latency_ms REAL)"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(checks)")}
+        if 'latency_ms' not in columns:  # caches written before latency was recorded
+            self.conn.execute("ALTER TABLE checks ADD COLUMN latency_ms REAL")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, endpoint, now=None):
+        """Return the cached (alive, latency_ms) outcome if it is still fresh, else None."""
+        now = time.time() if now is None else now
+        row = self.conn.execute(
+            "SELECT status, checked_at, latency_ms FROM checks WHERE endpoint = ?", (endpoint,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, checked_at, latency_ms = row
+        if status is None:
+            return None
+        ttl = self.ttl if status else self.negative_ttl
+        if now - checked_at >= ttl:
+            return None
+        return (bool(status), latency_ms if status else None)
+
+    def store(self, endpoint, result, now=None):
+        alive, error, latency_ms = result
+        status = None if error else (1 if alive else 0)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO checks (endpoint, status, checked_at, error, latency_ms)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (endpoint, status, time.time() if now is None else now, error, latency_ms),
+        )
+
+    def store_many(self, items, now=None):
+        now = time.time() if now is None else now
+        with self.conn:
+            for endpoint, result in items:
+                self.store(endpoint, result, now)
+
+    def split_rows(self, rows, key, now=None):
+        """Split rows into ((row, cached (alive, latency_ms)) pairs, rows that still need a check)."""
+        now = time.time() if now is None else now
+        cached, pending = [], []
+        for row in rows:
+            result = self.lookup(key(row), now)
+            if result is None:
+                pending.append(row)
+            else:
+                cached.append((row, result))
+        return cached, pending
+
+    def entries(self):
+        """Every cached (endpoint, status, checked_at, latency_ms), fresh or not."""
+        return self.conn.execute("SELECT endpoint, status, checked_at, latency_ms FROM checks").fetchall()
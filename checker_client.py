@@ -0,0 +1,240 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# failures that say "the checker is struggling", not "the proxy is dead";
+# 501 Not Implemented is a missing endpoint (e.g. no batch support), which retrying cannot fix
+RETRYABLE_STATUS = frozenset(range(500, 600)) - {501}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive checker failures and lets a single
+    trial request through once `cooldown` seconds have passed."""
+
+    def __init__(self, threshold=10, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                raise CircuitOpenError(f"checker circuit open after {self.failures} consecutive failures")
+            # half-open: let exactly one request probe the checker
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class AdaptiveLimits:
+    """Concurrency and timeout limits derived from observed checker behaviour.
+
+    The timeout follows the RFC 6298 retransmission timer: it starts at
+    initial_timeout (min_timeout by default) rather than max_timeout, so a
+    hanging checker fails fast and trips the breaker, then becomes smoothed
+    latency plus four times its variation, doubled on every timeout. The concurrency
+    limit is AIMD: halved at most once per smoothed round trip on 5xx or
+    timeouts, and grown back by one per window of successes."""
+
+    def __init__(self, max_concurrency, min_timeout=5.0, max_timeout=60.0, min_concurrency=1,
+                 initial_timeout=None):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        initial = min_timeout if initial_timeout is None else initial_timeout
+        self.rto = min(max_timeout, max(min_timeout, initial))
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return max(self.min_concurrency, int(self.concurrency))
+
+    @property
+    def timeout(self):
+        return self.rto
+
+    def on_success(self, latency):
+        with self.lock:
+            if self.srtt is None:
+                self.srtt, self.rttvar = latency, latency / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - latency)
+                self.srtt = 0.875 * self.srtt + 0.125 * latency
+            self.rto = min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def on_overload(self, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.rto = min(self.max_timeout, self.rto * 2)
+            now = time.monotonic()
+            # a burst of failures from one window counts as a single congestion signal
+            if now - self.last_decrease < (self.srtt or 1.0):
+                return
+            self.last_decrease = now
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+
+
+class ThreadGate:
+    def __init__(self, limits):
+        self.limits = limits
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def __enter__(self):
+        with self.cond:
+            while self.in_flight >= self.limits.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+
+class AsyncGate:
+    def __init__(self, limits):
+        self.limits = limits
+        self.in_flight = 0
+        self.cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limits.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+
+def make_session(pool_size=10):
+    """Keep-alive session whose pool keeps up to pool_size connections per host
+    (shared by the checker workers and by the pipeline stages)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class CheckerClient:
+    """Talks to the remote proxyip checker with retries, exponential backoff
+    with full jitter, a circuit breaker and adaptive concurrency/timeouts."""
+
+    def __init__(self, api_url_template, max_concurrency=50, max_retries=2,
+                 base_delay=0.5, max_delay=8.0, max_timeout=60.0, initial_timeout=None,
+                 breaker=None, session=None):
+        self.api_url_template = api_url_template
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.limits = AdaptiveLimits(max_concurrency, max_timeout=max_timeout, initial_timeout=initial_timeout)
+        # one keep-alive pool for every worker; urllib3's default of 10 connections
+        # would make most of them open and discard their own
+        self.session = session or make_session(max_concurrency)
+        self.gate = ThreadGate(self.limits)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def url(self, ip, port):
+        return self.api_url_template.format(ip=ip, port=port)
+
+    def get_json(self, ip, port):
+        return self.request_json('GET', self.url(ip, port))
+
+    def post_json(self, url, payload):
+        """POST payload as JSON (a batch of endpoints) with the same retry and breaker handling."""
+        return self.request_json('POST', url, json=payload)
+
+    def request_json(self, method, url, **kwargs):
+        """Returns (data, seconds) where seconds is the round trip of the attempt
+        that succeeded, without gate queueing, backoff or failed attempts."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.gate:
+                    # checked after the gate so queued requests see a breaker that opened meanwhile
+                    self.breaker.before_request()
+                    start = time.monotonic()
+                    response = self.session.request(method, url, timeout=self.limits.timeout, **kwargs)
+                    elapsed = time.monotonic() - start
+                if response.status_code in RETRYABLE_STATUS:
+                    response.raise_for_status()
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                    requests.exceptions.HTTPError) as e:
+                self.breaker.record_failure()
+                self.limits.on_overload(timed_out=isinstance(e, requests.exceptions.Timeout))
+                if attempt == self.max_retries or self.breaker.is_open:
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+            self.breaker.record_success()
+            self.limits.on_success(elapsed)
+            # 4xx and 501 are not the checker being overloaded: surface them without retrying
+            response.raise_for_status()
+            return response.json(), elapsed
+
+    async def get_json_async(self, session, ip, port, gate):
+        """Async twin of get_json; `gate` is an AsyncGate over self.limits."""
+        import aiohttp
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with gate:
+                    self.breaker.before_request()
+                    start = time.monotonic()
+                    timeout = aiohttp.ClientTimeout(total=self.limits.timeout)
+                    async with session.get(self.url(ip, port), timeout=timeout) as response:
+                        if response.status in RETRYABLE_STATUS:
+                            response.raise_for_status()
+                        body = await response.text()
+                    elapsed = time.monotonic() - start
+            except (aiohttp.ClientResponseError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                self.limits.on_overload(timed_out=isinstance(e, asyncio.TimeoutError))
+                if attempt == self.max_retries or self.breaker.is_open:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            self.breaker.record_success()
+            self.limits.on_success(elapsed)
+            response.raise_for_status()
+            return json.loads(body), elapsed
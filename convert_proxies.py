@@ -1,5 +1,14 @@
-import urllib.request
-from typing import Dict, List, Optional
+import os
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from fetch_cache import fetch
+from geo_index import country_for
+from host_resolver import plan_hosts
+from output_sink import write_lines_if_changed
+from proxy_index import LabelKey, ProxyIndex, in_input_order, use_index
+from proxy_record import ProxyRecord, ip_to_int
+from render_formats import OutputNode, format_path, parse_formats, render_outputs
 
 # 국가 코드와 한글 국가명 매핑 딕셔너리
 COUNTRY_MAP: Dict[str, str] = {
@@ -62,17 +71,43 @@ def get_country_korean_name(country_code: str) -> str:
     """국가 코드를 한글 국가명으로 변환"""
     return COUNTRY_MAP.get(country_code.upper(), '알수없음')
 
-def _process_single_line(line: str, is_cdn_host: bool = False) -> Optional[str]:
+def _parse_line_fields(line: str) -> Optional[Tuple[str, str, str]]:
     """
-    단일 프록시 라인을 새로운 형식으로 변환합니다.
-    (ip:port#COUNTRYCODE [CDN HOST] 한글국가명)
+    'ip:port#countrycode_name' 줄에서 (ip:port, 국가 코드, 한글 국가명)을 추출합니다.
+    '#'이 없으면 None을 반환합니다.
+    """
+    if '#' not in line:
+        return None
+    ip_port, country_info = line.split('#', 1)
+
+    # countrycode 부분만 추출
+    country_code = country_info.split('_')[0] if '_' in country_info else country_info
+
+    # 국가 코드를 대문자로 변환
+    # (IP 주소이고 로컬 IP 대역 데이터에서 찾으면 '#' 뒤의 표기 대신 그 값을 사용)
+    host = ip_port.rsplit(':', 1)[0]
+    country_code_upper = country_for(host) or country_code.upper()
+
+    # 한글 국가명 가져오기
+    return ip_port, country_code_upper, get_country_korean_name(country_code_upper)
+
+def _entry_nodes(index: ProxyIndex, source: str) -> Dict[LabelKey, OutputNode]:
+    """출처의 인덱스 항목들을 'ip:port#COUNTRYCODE 한글국가명' 노드로 변환 ((ip, port, 국가 코드, 이름) 키 -> 노드)"""
+    return {(entry.ip, entry.port, country_code, korean_name):
+            OutputNode(entry.endpoint, f"{country_code} {korean_name}")
+            for entry, country_code, korean_name in index.select(source)}
+
+def _process_single_node(line: str, is_cdn_host: bool = False) -> Optional[OutputNode]:
+    """
+    단일 프록시 라인을 출력 노드로 변환합니다.
+    (주소 ip:port, 라벨 COUNTRYCODE [CDN HOST] 한글국가명)
     
     Args:
         line: 입력 라인 문자열 (e.g., ip:port#countrycode_name 또는 ip:port#countrycode)
-        is_cdn_host: True이면 결과에 " CDN HOST" 문구를 추가합니다.
+        is_cdn_host: True이면 라벨에 " CDN HOST" 문구를 추가합니다.
         
     Returns:
-        변환된 라인 문자열, 처리할 수 없는 경우 원본 라인, 또는 빈 라인의 경우 None
+        변환된 노드, 처리할 수 없는 경우 원본 라인을 그대로 담은 노드, 또는 빈 라인의 경우 None
     """
     line = line.strip()
     if not line:
@@ -80,73 +115,129 @@ def _process_single_line(line: str, is_cdn_host: bool = False) -> Optional[str]:
         
     try:
         # ip:port#countrycode_name 형식 파싱
-        if '#' in line:
-            ip_port, country_info = line.split('#', 1)
-            
-            # countrycode 부분만 추출
-            country_code = country_info.split('_')[0] if '_' in country_info else country_info
-            
-            # 국가 코드를 대문자로 변환
-            country_code_upper = country_code.upper()
-            
-            # 한글 국가명 가져오기
-            korean_name = get_country_korean_name(country_code_upper)
+        fields = _parse_line_fields(line)
+        if fields is not None:
+            ip_port, country_code_upper, korean_name = fields
             
             # CDN HOST 문구 조건부 추가
             # is_cdn_host가 True일 때만 ' CDN HOST' 문자열을 추가합니다.
             extra_tag = " CDN HOST" if is_cdn_host else ""
             
-            # 새로운 형식으로 변환: ip:port#COUNTRYCODE [CDN HOST] 한글국가명
-            return f"{ip_port}#{country_code_upper}{extra_tag} {korean_name}"
+            # 새로운 형식: ip:port#COUNTRYCODE [CDN HOST] 한글국가명
+            return OutputNode(ip_port, f"{country_code_upper}{extra_tag} {korean_name}")
             
     except ValueError:
         # 파싱 오류 시 원본 라인 유지
-        return line
+        return OutputNode.passthrough(line)
         
     # '#'이 없는 경우 원본 라인 유지
-    return line 
+    return OutputNode.passthrough(line)
 
-def convert_proxy_format(input_url: str, output_file: str = "converted_proxies.txt"):
+def _process_single_line(line: str, is_cdn_host: bool = False) -> Optional[str]:
     """
-    URL에서 프록시 데이터를 가져와 형식을 변환하고 고정 목록을 추가하여 파일로 저장
+    단일 프록시 라인을 새로운 형식으로 변환합니다.
+    (ip:port#COUNTRYCODE [CDN HOST] 한글국가명)
+    
+    Returns:
+        변환된 라인 문자열, 처리할 수 없는 경우 원본 라인, 또는 빈 라인의 경우 None
+    """
+    node = _process_single_node(line, is_cdn_host)
+    return node.text if node is not None else None
+
+def _fixed_nodes() -> List[OutputNode]:
+    """
+    FIXED_PROXIES를 " CDN HOST" 태그가 붙은 노드로 변환하고 DNS 조회 결과에 따라 정리합니다.
+    (조회되지 않는 호스트는 FIXED_HOST_POLICY에 따라 뒤로 옮기거나 제외하고,
+    DNS_EXPAND=1이면 호스트 대신 A 레코드 주소를 같은 라벨로 출력합니다.)
+    """
+    fixed = [node for node in (_process_single_node(line, is_cdn_host=True) for line in FIXED_PROXIES)
+             if node is not None and node.raw is None]
+    hosts = [node.address.rpartition(':')[0] for node in fixed]
+    return [fixed[position]._replace(address=host + fixed[position].address[len(hosts[position]):])
+            for position, host in plan_hosts(hosts)]
+
+def _to_record(line: str) -> Optional[ProxyRecord]:
+    """IPv4 'ip:port#...' 줄을 인덱스에 넣을 레코드로 변환 (국가 코드/한글 국가명을 레이블로 사용)"""
+    fields = _parse_line_fields(line.strip())
+    if fields is None:
+        return None
+    ip_port, country_code_upper, korean_name = fields
+    ip, _, port = ip_port.rpartition(':')
+    ip_value = ip_to_int(ip)
+    if ip_value is None or not port.isdigit() or not 0 < int(port) < 65536:
+        return None
+    return ProxyRecord(ip_value, int(port), country_code_upper, korean_name)
+
+def convert_proxy_format(input_url: str, output_file: str = "converted_proxies.txt",
+                         skip_if_unchanged: bool = False, session=None,
+                         index: Optional[ProxyIndex] = None):
+    """
+    URL에서 프록시 데이터를 가져와 공유 인덱스(ProxyIndex)에 병합하고,
+    인덱스에서 형식을 변환한 뒤 고정 목록을 추가하여 파일로 저장
+    (주소와 국가 코드가 모두 같은 줄은 한 번만 출력되며 IPv4가 아닌 줄은 변환 규칙만 적용해 입력 순서대로 출력합니다.)
+    RENDER_FORMATS에 clash/base64가 있으면 같은 노드 목록으로 해당 형식 파일도 함께 저장합니다.
     
     Args:
         input_url: 원본 데이터 URL
         output_file: 출력 파일명
+        skip_if_unchanged: True이면 원본이 이전 실행과 같고(304 또는 같은 해시)
+            모든 형식의 출력 파일이 이미 있을 때 변환과 저장을 건너뜁니다.
+        session: 재사용할 requests.Session (파이프라인에서 공유)
+        index: 병합할 인덱스 (없으면 이 호출에서만 쓰는 인덱스를 만듭니다)
     """
-    processed_lines = []
+    nodes: List[OutputNode] = []
+    formats = parse_formats()
+    if index is None:
+        index = ProxyIndex()
+    stage_metrics = metrics.current()
     
     try:
-        # urllib를 사용하여 파일 내용 가져오기
-        with urllib.request.urlopen(input_url) as response:
-            data = response.read().decode('utf-8')
-        
-        lines = data.strip().split('\n')
-        
-        # 1. URL에서 가져온 라인 처리 (CDN HOST 태그 미적용)
-        for line in lines:
-            result = _process_single_line(line, is_cdn_host=False)
-            if result is not None:
-                processed_lines.append(result)
+        # 조건부 요청(ETag/Last-Modified)으로 파일 내용 가져오기
+        fetched = fetch(input_url, session=session)
+        if (skip_if_unchanged and not fetched.changed
+                and all(os.path.exists(format_path(output_file, fmt)) for fmt in formats)):
+            print(f"원본 데이터가 변경되지 않아 {output_file} 변환을 건너뜁니다.")
+            index.touch(input_url)
+            return
+        with stage_metrics.timer('parse'):
+            data = fetched.text()
+            
+            lines = data.strip().split('\n')
+            
+            # 1. URL에서 가져온 라인을 인덱스에 병합하고 인덱스에서 출력 (CDN HOST 태그 미적용)
+            #    IPv4가 아닌 줄은 인덱스에 넣지 않고 변환 규칙만 적용해 원래 위치에 출력합니다.
+            records = []
+            layout: List[Tuple[Optional[LabelKey], Optional[OutputNode]]] = []
+            for line in lines:
+                record = _to_record(line)
+                if record is not None:
+                    records.append(record)
+                    layout.append(((record.ip, record.port, record.country, record.provider), None))
+                    continue
+                node = _process_single_node(line, is_cdn_host=False)
+                if node is not None:
+                    layout.append((None, node))
+            stage_metrics.add('rows_processed', len(lines))
+            stage_metrics.add('rows_merged', index.merge(input_url, records))
+            nodes.extend(in_input_order(layout, _entry_nodes(index, input_url)))
         
     except Exception as e:
         print(f"URL에서 데이터를 가져오는 중 오류 발생: {e}")
     
     # 2. 고정 목록 라인 처리 및 추가 (CDN HOST 태그 적용)
-    for line in FIXED_PROXIES:
-        # FIXED_PROXIES는 is_cdn_host=True로 처리하여 " CDN HOST" 태그를 추가합니다.
-        fixed_result = _process_single_line(line, is_cdn_host=True)
-        if fixed_result is not None:
-            processed_lines.append(fixed_result)
+    nodes.extend(_fixed_nodes())
             
-    # 3. 결과를 파일로 저장
-    if processed_lines:
+    # 3. 결과를 형식별 파일로 저장 (노드 목록을 한 번만 순회)
+    if nodes:
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                for result in processed_lines:
-                    f.write(result + '\n')
-            
-            print(f"변환 완료: 총 {len(processed_lines)}개의 항목(고정 목록 포함)이 {output_file}에 저장되었습니다.")
+            with stage_metrics.timer('write'):
+                written = render_outputs(nodes, output_file, formats)
+            for fmt, was_written in written.items():
+                path = format_path(output_file, fmt)
+                if was_written:
+                    print(f"변환 완료: 총 {len(nodes)}개의 항목(고정 목록 포함)이 {path}에 저장되었습니다.")
+                else:
+                    print(f"변환 완료: 내용이 같아 {path} 파일을 다시 쓰지 않았습니다.")
         except Exception as e:
             print(f"파일 저장 중 오류 발생: {e}")
     else:
@@ -189,20 +280,28 @@ def convert_local_file(input_file: str, output_file: str = "converted_proxies.tx
     # 3. 결과를 파일로 저장
     if processed_lines:
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                for result in processed_lines:
-                    f.write(result + '\n')
-            
-            print(f"변환 완료: 총 {len(processed_lines)}개의 항목(고정 목록 포함)이 {output_file}에 저장되었습니다.")
+            if write_lines_if_changed(output_file, processed_lines):
+                print(f"변환 완료: 총 {len(processed_lines)}개의 항목(고정 목록 포함)이 {output_file}에 저장되었습니다.")
+            else:
+                print(f"변환 완료: 내용이 같아 {output_file} 파일을 다시 쓰지 않았습니다.")
         except Exception as e:
             print(f"파일 저장 중 오류 발생: {e}")
     else:
         print("처리된 유효한 항목이 없으므로 파일이 저장되지 않았습니다.")
 
-if __name__ == "__main__":
+SOURCE_URL = "https://raw.githubusercontent.com/rxsweet/cfip/refs/heads/main/all.txt"
+
+def main(session=None, index=None):
+    """converted_proxies.txt 생성 (pipeline.py에서 공유 세션, 공유 인덱스와 함께 호출할 수 있습니다)"""
     # GitHub URL에서 직접 변환
-    url = "https://raw.githubusercontent.com/rxsweet/cfip/refs/heads/main/all.txt"
-    convert_proxy_format(url, "converted_proxies.txt")
+    with use_index(index) as index:
+        convert_proxy_format(SOURCE_URL, "converted_proxies.txt", skip_if_unchanged=True,
+                             session=session, index=index)
     
     # 로컬 파일 변환 (필요한 경우)
     # convert_local_file("all.txt", "converted_proxies_local.txt")
+
+if __name__ == "__main__":
+    with metrics.stage('convert_proxies'):
+        main()
+    metrics.write_summary()
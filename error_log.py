@@ -0,0 +1,184 @@
+import json
+import os
+import socket
+from collections import Counter
+from datetime import datetime, timedelta
+
+import requests
+
+from checker_client import CircuitOpenError
+
+# error classes
+HTTP_5XX = 'http_5xx'
+HTTP_4XX = 'http_4xx'
+TIMEOUT = 'timeout'
+JSON_DECODE = 'json_decode'
+CONNECTION_RESET = 'connection_reset'
+CONNECTION = 'connection'
+CIRCUIT_OPEN = 'circuit_open'
+OTHER = 'other'
+
+# classes that mean the checker (not the proxy) failed
+CHECKER_FAILURES = {HTTP_5XX, HTTP_4XX, TIMEOUT, JSON_DECODE, CONNECTION_RESET, CONNECTION, CIRCUIT_OPEN}
+
+DEFAULT_SAMPLES = 5
+DEFAULT_MAX_BYTES = 256 * 1024
+DEFAULT_MAX_AGE = timedelta(days=7)
+DEFAULT_BACKUPS = 3
+
+
+class CheckError(str):
+    """Error message that also carries its error-class code."""
+
+    def __new__(cls, message, code=OTHER):
+        error = super().__new__(cls, message)
+        error.code = code
+        return error
+
+
+def _status_code(exc):
+    response = getattr(exc, 'response', None)
+    if response is not None and getattr(response, 'status_code', None):
+        return response.status_code
+    # aiohttp.ClientResponseError
+    return getattr(exc, 'status', None)
+
+
+def classify(exc):
+    if isinstance(exc, CircuitOpenError):
+        return CIRCUIT_OPEN
+    status = _status_code(exc)
+    if isinstance(status, int) and status >= 400:
+        return HTTP_5XX if status >= 500 else HTTP_4XX
+    if (isinstance(exc, (requests.exceptions.Timeout, TimeoutError, socket.timeout))
+            or type(exc).__name__ == 'TimeoutError'):
+        return TIMEOUT
+    if isinstance(exc, ValueError) and not isinstance(exc, requests.exceptions.RequestException):
+        return JSON_DECODE
+    if isinstance(exc, requests.exceptions.JSONDecodeError):
+        return JSON_DECODE
+    text = str(exc)
+    if (isinstance(exc, ConnectionResetError) or 'Connection reset' in text
+            or type(exc).__name__ == 'ServerDisconnectedError'):
+        return CONNECTION_RESET
+    if isinstance(exc, (requests.exceptions.ConnectionError, ConnectionError, OSError)):
+        return CONNECTION
+    if type(exc).__name__.startswith('Client'):  # other aiohttp client errors
+        return CONNECTION
+    return OTHER
+
+
+def classify_message(message):
+    """Best-effort class for a plain error string (e.g. read back from a partial result)."""
+    code = getattr(message, 'code', None)
+    if code:
+        return code
+    text = str(message)
+    if 'circuit open' in text:
+        return CIRCUIT_OPEN
+    if 'parsing JSON' in text:
+        return JSON_DECODE
+    if ' 5' in text and ('Server Error' in text or "message='" in text):
+        return HTTP_5XX
+    if 'Client Error' in text:
+        return HTTP_4XX
+    if 'timed out' in text.lower() or 'TimeoutError' in text:
+        return TIMEOUT
+    if 'Connection reset' in text or 'ServerDisconnected' in text:
+        return CONNECTION_RESET
+    if 'Connection' in text or 'connect' in text:
+        return CONNECTION
+    return OTHER
+
+
+class ErrorLog:
+    """Per-run aggregate of check errors: counts per class plus a bounded
+    sample of raw messages per class, appended as one JSON line per run.
+    Cache hits are only counted, so the verdict judges this run's checks."""
+
+    def __init__(self, samples=DEFAULT_SAMPLES):
+        self.samples = samples
+        self.started_at = datetime.now()
+        self.counts = Counter()
+        self.messages = {}
+        self.alive = 0
+        self.dead = 0
+        self.cached = 0
+
+    def record_result(self, alive, error, cached=False):
+        if cached:
+            self.cached += 1
+        elif error:
+            self.record(error)
+        elif alive:
+            self.alive += 1
+        else:
+            self.dead += 1
+
+    def record(self, error):
+        code = classify_message(error)
+        self.counts[code] += 1
+        bucket = self.messages.setdefault(code, [])
+        if len(bucket) < self.samples:
+            # the checker URL repeats the endpoint and the API host; keep only the message
+            bucket.append(str(error).split(' for url: ')[0].split(", url='")[0])
+
+    @property
+    def errors(self):
+        return sum(self.counts.values())
+
+    def verdict(self):
+        checked = self.alive + self.dead + self.errors
+        checker_errors = sum(n for code, n in self.counts.items() if code in CHECKER_FAILURES)
+        if checked == 0:
+            return 'nothing_checked'
+        if checker_errors * 2 > checked:
+            return 'checker_failed'
+        if self.alive == 0:
+            return 'proxies_dead'
+        return 'ok'
+
+    def summary(self):
+        return {
+            'run_at': self.started_at.isoformat(timespec='seconds'),
+            'verdict': self.verdict(),
+            'alive': self.alive,
+            'dead': self.dead,
+            'errors': self.errors,
+            'cached': self.cached,
+            'counts': dict(self.counts.most_common()),
+            'samples': self.messages,
+        }
+
+    def write(self, path, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, backups=DEFAULT_BACKUPS):
+        rotate_if_needed(path, max_bytes, max_age, backups)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.summary(), ensure_ascii=False) + '\n')
+
+
+def _first_run_at(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return datetime.fromisoformat(json.loads(f.readline())['run_at'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def rotate_if_needed(path, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, backups=DEFAULT_BACKUPS):
+    """Rotate path -> path.1 -> ... -> path.<backups> when it is too big or too old."""
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return False
+    first = _first_run_at(path)
+    too_old = first is not None and datetime.now() - first > max_age
+    if size < max_bytes and not too_old:
+        return False
+    for i in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    if backups > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+    return True
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+import requests
+
+import metrics
+
+# 응답 본문과 검증자(ETag/Last-Modified)를 저장할 디렉터리 (git에는 포함하지 않음)
+CACHE_DIR = os.path.join('.cache', 'http')
+
+
+class FetchResult:
+    """
+    조건부 요청 결과.
+
+    Attributes:
+        url: 요청한 URL.
+        status: 'modified'(새 내용), 'not_modified'(304 응답), 'unchanged'(200이지만 해시가 같음).
+        body_path: 응답 본문이 저장된 캐시 파일 경로.
+    """
+
+    def __init__(self, url: str, status: str, body_path: str):
+        self.url = url
+        self.status = status
+        self.body_path = body_path
+
+    @property
+    def changed(self) -> bool:
+        return self.status == 'modified'
+
+    def open(self, mode: str = 'rb'):
+        if 'b' in mode:
+            return open(self.body_path, mode)
+        return open(self.body_path, mode, encoding='utf-8')
+
+    def text(self) -> str:
+        with self.open('r') as f:
+            return f.read()
+
+
+def _cache_paths(url: str):
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, key + '.json'), os.path.join(CACHE_DIR, key + '.body')
+
+
+def _load_meta(meta_path: str, body_path: str) -> Dict[str, str]:
+    # 본문 파일이 없으면 검증자를 보내도 304를 활용할 수 없으므로 메타데이터를 버립니다.
+    if not os.path.exists(body_path):
+        return {}
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def fetch(
+    url: str,
+    session=None,
+    timeout: float = 20,
+    headers: Optional[Dict[str, str]] = None,
+    force: bool = False
+) -> FetchResult:
+    """
+    URL을 조건부 요청(If-None-Match / If-Modified-Since)으로 가져와 디스크 캐시에 저장합니다.
+    서버가 304를 돌려주거나, 검증자를 지원하지 않더라도 본문 해시가 이전과 같으면
+    changed가 False인 결과를 반환하므로 호출 측에서 파싱/출력 단계를 건너뛸 수 있습니다.
+
+    Args:
+        url: 가져올 URL.
+        session: 재사용할 requests.Session (없으면 requests 모듈 사용).
+        timeout: 요청 타임아웃(초).
+        headers: 추가로 보낼 HTTP 헤더.
+        force: True이면 검증자와 해시 비교를 무시하고 항상 changed로 처리합니다.
+
+    Raises:
+        requests.exceptions.RequestException: 네트워크/HTTP 오류가 발생한 경우.
+    """
+    with metrics.current().timer('fetch'):
+        return _fetch(url, session, timeout, headers, force)
+
+
+def _fetch(url: str, session, timeout: float, headers: Optional[Dict[str, str]], force: bool) -> FetchResult:
+    stage_metrics = metrics.current()
+    stage_metrics.add('fetch_requests')
+    force = force or os.getenv('FETCH_FORCE') == '1'
+    meta_path, body_path = _cache_paths(url)
+    meta = _load_meta(meta_path, body_path)
+
+    request_headers = dict(headers or {})
+    if not force:
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+
+    http = session or requests
+    with http.get(url, timeout=timeout, headers=request_headers, stream=True) as response:
+        if response.status_code == 304 and meta:
+            stage_metrics.add('fetch_not_modified')
+            return FetchResult(url, 'not_modified', body_path)
+        response.raise_for_status()
+
+        # 본문을 임시 파일로 스트리밍하면서 해시를 계산합니다.
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        digest = hashlib.sha256()
+        tmp_path = body_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                digest.update(chunk)
+                f.write(chunk)
+                stage_metrics.add('bytes_downloaded', len(chunk))
+        os.replace(tmp_path, body_path)
+
+        new_meta = {
+            'url': url,
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+            'sha256': digest.hexdigest(),
+        }
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(new_meta, f)
+
+    if not force and meta.get('sha256') == new_meta['sha256']:
+        return FetchResult(url, 'unchanged', body_path)
+    return FetchResult(url, 'modified', body_path)
@@ -0,0 +1,213 @@
+import csv
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional
+
+from proxy_record import ip_to_int
+
+# IP 대역 -> 국가 코드 데이터 파일 (GEO_DB 환경 변수로 변경, 빈 문자열이면 사용하지 않음)
+# 형식: 'start,end,CC' 한 줄에 한 대역. start/end는 IPv4 문자열 또는 uint32 정수.
+# (DB-IP "IP to Country Lite" CSV를 그대로 사용할 수 있으며 IPv6 줄은 건너뜁니다.)
+DEFAULT_GEO_DB = 'ip2country.csv'
+
+# 파싱한 대역 배열을 저장할 디렉터리 (git에는 포함하지 않음)
+CACHE_DIR = os.path.join('.cache', 'geo')
+
+# 헤더: magic, version, byteorder(0=little/1=big), 원본 크기, 원본 내용 해시, 대역 수, 국가 코드 테이블 길이
+# (CI처럼 매번 새로 내려받아 mtime이 바뀌어도 내용이 같으면 캐시를 사용하도록 내용으로 비교합니다.)
+_HEADER = struct.Struct('<4sHBxQ16sII')
+_MAGIC = b'GEO1'
+_VERSION = 2
+
+
+def _parse_ip(value: str) -> Optional[int]:
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return number if number <= 0xFFFFFFFF else None
+    return ip_to_int(value)
+
+
+class GeoIndex:
+    """
+    정렬된 IPv4 대역(start, end) 배열과 대역별 국가 코드 인덱스.
+    조회는 이진 탐색(bisect) 한 번이며 네트워크 요청을 하지 않습니다.
+    """
+
+    def __init__(self, starts: array, ends: array, code_idx: array, codes: List[str]):
+        self.starts = starts
+        self.ends = ends
+        self.code_idx = code_idx
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def lookup_int(self, ip: int) -> Optional[str]:
+        """uint32 IP가 속한 대역의 국가 코드. 어느 대역에도 없으면 None."""
+        i = bisect_right(self.starts, ip) - 1
+        if i < 0 or ip > self.ends[i]:
+            return None
+        return self.codes[self.code_idx[i]]
+
+    def lookup(self, ip: str) -> Optional[str]:
+        """IPv4 문자열의 국가 코드. IPv4가 아니거나(도메인 등) 대역에 없으면 None."""
+        value = ip_to_int(ip)
+        return None if value is None else self.lookup_int(value)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[List[str]]) -> 'GeoIndex':
+        ranges = []
+        for row in rows:
+            if len(row) < 3:
+                continue
+            start, end = _parse_ip(row[0]), _parse_ip(row[1])
+            code = row[2].strip().upper()
+            if start is None or end is None or start > end or not code or code == 'ZZ':
+                continue
+            ranges.append((start, end, sys.intern(code)))
+        ranges.sort()
+
+        codes: List[str] = []
+        lookup: Dict[str, int] = {}
+        starts, ends, code_idx = array('I'), array('I'), array('H')
+        for start, end, code in ranges:
+            # 겹치는 대역은 앞선 대역을 우선하고 겹친 부분만 잘라냅니다.
+            if ends and start <= ends[-1]:
+                if end <= ends[-1]:
+                    continue
+                start = ends[-1] + 1
+            index = lookup.get(code)
+            if index is None:
+                index = lookup[code] = len(codes)
+                codes.append(code)
+            starts.append(start)
+            ends.append(end)
+            code_idx.append(index)
+        return cls(starts, ends, code_idx, codes)
+
+
+def _cache_path_for(source_path: str) -> str:
+    return os.path.join(CACHE_DIR, os.path.basename(source_path) + '.geo')
+
+
+def _byteorder_flag() -> int:
+    return 0 if sys.byteorder == 'little' else 1
+
+
+def _source_digest(source_path: str) -> bytes:
+    """원본 파일 내용의 해시 (파싱보다 훨씬 빠릅니다)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(source_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def save_index(index: GeoIndex, cache_path: str, source_size: int, source_digest: bytes):
+    """대역 배열을 바이너리로 저장합니다. (임시 파일에 쓴 뒤 교체)"""
+    codes = json.dumps(index.codes).encode('utf-8')
+    header = _HEADER.pack(_MAGIC, _VERSION, _byteorder_flag(),
+                          source_size, source_digest, len(index), len(codes))
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(codes)
+        for column in (index.starts, index.ends, index.code_idx):
+            column.tofile(f)
+    os.replace(tmp_path, cache_path)
+
+
+def _load_cached(cache_path: str, source_size: int, source_digest: bytes) -> Optional[GeoIndex]:
+    try:
+        f = open(cache_path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        magic, version, byteorder, size, digest, count, codes_len = _HEADER.unpack(header)
+        if (magic != _MAGIC or version != _VERSION or byteorder != _byteorder_flag()
+                or size != source_size or digest != source_digest):
+            return None
+        codes = json.loads(f.read(codes_len))
+        starts, ends, code_idx = array('I'), array('I'), array('H')
+        try:
+            for column in (starts, ends, code_idx):
+                column.fromfile(f, count)
+        except EOFError:
+            return None
+    return GeoIndex(starts, ends, code_idx, codes)
+
+
+def load_index(source_path: str, cache_path: Optional[str] = None) -> GeoIndex:
+    """
+    IP 대역 데이터 파일을 GeoIndex로 불러옵니다.
+    원본 파일의 크기와 내용 해시가 캐시와 같으면 바이너리 캐시를 사용하고, 다르면 다시 파싱합니다.
+
+    Raises:
+        FileNotFoundError: 데이터 파일이 없는 경우.
+    """
+    cache_path = cache_path or _cache_path_for(source_path)
+    source_size = os.stat(source_path).st_size
+    source_digest = _source_digest(source_path)
+
+    index = _load_cached(cache_path, source_size, source_digest)
+    if index is not None:
+        return index
+
+    with open(source_path, 'r', encoding='utf-8', newline='') as f:
+        index = GeoIndex.from_rows(row for row in csv.reader(f) if row and not row[0].startswith('#'))
+    try:
+        save_index(index, cache_path, source_size, source_digest)
+    except OSError as e:
+        print(f"국가 대역 캐시 저장 중 오류 발생: {e}")
+    return index
+
+
+_shared_index: Optional[GeoIndex] = None
+_shared_loaded = False
+_shared_lock = threading.Lock()
+
+
+def get_index() -> Optional[GeoIndex]:
+    """
+    모든 스크립트가 공유하는 GeoIndex를 한 번만 불러와 반환합니다. (파이프라인의 단계 스레드 간 공유)
+    데이터 파일이 없거나 GEO_DB가 빈 문자열이면 None을 반환하며, 호출 측은 기존 방식으로 국가를 정합니다.
+    """
+    global _shared_index, _shared_loaded
+    with _shared_lock:
+        if not _shared_loaded:
+            _shared_loaded = True
+            path = os.getenv('GEO_DB', DEFAULT_GEO_DB)
+            if path and os.path.exists(path):
+                try:
+                    _shared_index = load_index(path)
+                except (OSError, ValueError) as e:
+                    print(f"국가 대역 데이터를 읽지 못했습니다 ({path}): {e}")
+        return _shared_index
+
+
+def country_for(host: str) -> Optional[str]:
+    """호스트(IPv4 문자열)의 국가 코드. 인덱스가 없거나 찾지 못하면 None."""
+    index = get_index()
+    return index.lookup(host) if index is not None else None
+
+
+if __name__ == "__main__":
+    # 사용 예: python geo_index.py 1.1.1.1 8.8.8.8
+    geo = get_index()
+    if geo is None:
+        print(f"국가 대역 데이터 파일이 없습니다: {os.getenv('GEO_DB', DEFAULT_GEO_DB)}")
+        sys.exit(1)
+    print(f"{len(geo)}개 대역, {len(geo.codes)}개 국가")
+    for address in sys.argv[1:]:
+        print(f"{address}: {geo.lookup(address) or '알수없음'}")
@@ -0,0 +1,133 @@
+import os
+import struct
+import time
+from collections import defaultdict
+
+from proxy_record import int_to_ip, ip_to_int
+
+DEFAULT_PATH = os.path.join('.cache', 'health.bin')
+# records older than this are dropped when the file is compacted
+DEFAULT_RETENTION = 14 * 24 * 3600
+# a check this old counts half as much as one made now
+DEFAULT_HALF_LIFE = 24 * 3600
+# a proxy this slow (ms, decayed mean of its alive checks) loses a quarter of its score
+LATENCY_SCALE_MS = 1000.0
+# uptime assumed for a proxy with no history; it is also blended in as one
+# pseudo-check so that a single lucky result does not top the ranking
+PRIOR_UPTIME = 0.5
+
+_MAGIC = b'HLT1'
+# ip (uint32), port, checked_at (unix seconds), alive (0/1), latency ms (NO_LATENCY if unknown)
+_RECORD = struct.Struct('<IHIBH')
+NO_LATENCY = 0xFFFF
+
+
+class HealthHistory:
+    """Append-only log of alive/dead check outcomes per ip:port, 13 bytes per
+    check. Checker errors are not outcomes and are not recorded."""
+
+    def __init__(self, path=DEFAULT_PATH, retention=DEFAULT_RETENTION, half_life=DEFAULT_HALF_LIFE):
+        self.path = path
+        self.retention = retention
+        self.half_life = half_life
+
+    def append(self, results, now=None):
+        """Record (endpoint, (alive, error, latency_ms)) results; returns how many were written."""
+        checked_at = int(time.time() if now is None else now)
+        data = bytearray()
+        for endpoint, (alive, error, latency_ms) in results:
+            if error:
+                continue
+            ip, _, port = endpoint.rpartition(':')
+            ip_value = ip_to_int(ip)
+            if ip_value is None or not port.isdigit() or int(port) > 0xFFFF:
+                continue
+            if alive and latency_ms is not None:
+                latency = min(int(round(latency_ms)), NO_LATENCY - 1)
+            else:
+                latency = NO_LATENCY
+            data += _RECORD.pack(ip_value, int(port), checked_at, 1 if alive else 0, latency)
+        if not data:
+            return 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'ab') as f:
+            size = f.tell()
+            if size == 0:
+                f.write(_MAGIC)
+            elif (size - len(_MAGIC)) % _RECORD.size:
+                # a run killed mid-write left a torn record; drop it so the next ones stay aligned
+                f.truncate(size - (size - len(_MAGIC)) % _RECORD.size)
+            f.write(data)
+        return len(data) // _RECORD.size
+
+    def records(self):
+        """All complete records in the file (a torn trailing record is ignored)."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        if not data.startswith(_MAGIC):
+            print(f"Ignoring health history {self.path}: unknown format.")
+            return []
+        end = len(_MAGIC) + (len(data) - len(_MAGIC)) // _RECORD.size * _RECORD.size
+        return list(_RECORD.iter_unpack(memoryview(data)[len(_MAGIC):end]))
+
+    def compact(self, records=None, now=None):
+        """Rewrite the file without records older than the retention period;
+        returns how many were dropped."""
+        now = time.time() if now is None else now
+        records = self.records() if records is None else records
+        kept = [record for record in records if now - record[2] <= self.retention]
+        dropped = len(records) - len(kept)
+        if dropped:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_MAGIC)
+                f.write(b''.join(_RECORD.pack(*record) for record in kept))
+            os.replace(tmp_path, self.path)
+        return dropped
+
+    def scores(self, now=None):
+        """Rolling score in [0, 1] per endpoint: exponentially decayed uptime
+        (with PRIOR_UPTIME as one pseudo-check), scaled down by up to half for a
+        slow decayed mean latency. Compacts the file when at least a quarter
+        of it is past retention."""
+        now = time.time() if now is None else now
+        records = self.records()
+        stats = defaultdict(lambda: [0.0, 0.0, 0.0, 0.0])  # weight, alive weight, latency sum, latency weight
+        expired = 0
+        for ip, port, checked_at, alive, latency in records:
+            age = now - checked_at
+            if age > self.retention:
+                expired += 1
+                continue
+            weight = 0.5 ** (max(age, 0) / self.half_life)
+            entry = stats[(ip, port)]
+            entry[0] += weight
+            if alive:
+                entry[1] += weight
+                if latency != NO_LATENCY:
+                    entry[2] += weight * latency
+                    entry[3] += weight
+        if expired and expired * 4 >= len(records):
+            self.compact(records, now)
+
+        scores = {}
+        for (ip, port), (weight, alive_weight, latency_sum, latency_weight) in stats.items():
+            uptime = (alive_weight + PRIOR_UPTIME) / (weight + 1)
+            speed = 1.0
+            if latency_weight:
+                speed = LATENCY_SCALE_MS / (LATENCY_SCALE_MS + latency_sum / latency_weight)
+            scores[f"{int_to_ip(ip)}:{port}"] = uptime * (0.5 + 0.5 * speed)
+        return scores
+
+
+def prioritize(rows, scores, key, budget=0):
+    """Rows best score first (no history counts as PRIOR_UPTIME, ties keep
+    input order). With a budget, only that many rows are kept.
+    Returns (rows, dropped_rows)."""
+    ordered = sorted(rows, key=lambda row: -scores.get(key(row), PRIOR_UPTIME))
+    if budget and len(ordered) > budget:
+        return ordered[:budget], ordered[budget:]
+    return ordered, []
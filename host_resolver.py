@@ -0,0 +1,250 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+from proxy_record import ip_to_int
+
+# 고정 호스트의 DNS 조회 결과를 보관할 파일 (git에는 포함하지 않음)
+CACHE_PATH = os.path.join('.cache', 'dns.json')
+
+# 조회기가 TTL을 알려주지 않을 때 성공/실패 결과를 캐시에 보관할 시간(초)
+# (DNS_TTL, DNS_NEGATIVE_TTL 환경 변수로 변경)
+DEFAULT_TTL = 3600
+DEFAULT_NEGATIVE_TTL = 300
+
+# 한 번의 조회 전체에 허용할 시간(초)과 동시 조회 수 (DNS_TIMEOUT, DNS_WORKERS)
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_WORKERS = 16
+
+# 조회되지 않는 고정 호스트 처리 방식 (FIXED_HOST_POLICY 환경 변수)
+# demote: 목록 끝으로 이동, drop: 제외, keep: 조회하지 않고 기존처럼 그대로 추가
+POLICIES = ('demote', 'drop', 'keep')
+DEFAULT_POLICY = 'demote'
+
+# 조회기: 호스트 -> (IPv4 주소 목록, TTL(초) 또는 None). 조회 실패는 빈 목록 또는 OSError.
+Resolver = Callable[[str], Tuple[List[str], Optional[float]]]
+
+
+def system_resolver(host: str) -> Tuple[List[str], Optional[float]]:
+    """시스템 조회기(getaddrinfo)로 A 레코드를 찾습니다. TTL은 알 수 없으므로 None."""
+    infos = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
+    return sorted({info[4][0] for info in infos}, key=ip_to_int), None
+
+
+def hosts_file_resolver(path: str) -> Resolver:
+    """
+    hosts 파일 형식('IP 호스트 [호스트...]', '#' 주석)의 파일로 조회하는 조회기.
+    네트워크 없이 결과를 고정해야 할 때(테스트, 오프라인 실행) DNS_HOSTS_FILE로 지정합니다.
+    """
+    table: Dict[str, List[str]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if len(fields) < 2 or ip_to_int(fields[0]) is None:
+                continue
+            for host in fields[1:]:
+                addresses = table.setdefault(host.lower(), [])
+                if fields[0] not in addresses:
+                    addresses.append(fields[0])
+
+    def resolve(host: str) -> Tuple[List[str], Optional[float]]:
+        return list(table.get(host.lower(), [])), None
+
+    return resolve
+
+
+class HostResolver:
+    """
+    호스트 목록을 동시에 조회하고 결과를 TTL 동안 디스크 캐시에 보관합니다.
+    파이프라인 단계들이 같은 호스트를 조회하므로 조회는 잠금 안에서 한 번에 하나씩 수행하고,
+    뒤에 온 단계는 앞 단계가 채운 캐시를 사용합니다.
+    """
+
+    def __init__(self, resolver: Optional[Resolver] = None, cache_path: Optional[str] = CACHE_PATH,
+                 ttl: float = DEFAULT_TTL, negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+                 timeout: float = DEFAULT_TIMEOUT, workers: int = DEFAULT_WORKERS):
+        self.resolver = resolver or system_resolver
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.workers = workers
+        # 호스트 -> (주소 목록, 만료 시각)
+        self.cache: Dict[str, Tuple[List[str], float]] = self._load()
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Tuple[List[str], float]]:
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"DNS 캐시 파일을 읽지 못해 새로 만듭니다 ({self.cache_path}): {e}")
+            return {}
+        if data.get('version') != 1:
+            return {}
+        return {host: (addresses, expires_at) for host, (addresses, expires_at) in data['hosts'].items()}
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'hosts': self.cache}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.cache_path)
+
+    def _lookup(self, host: str) -> Tuple[List[str], Optional[float]]:
+        try:
+            addresses, ttl = self.resolver(host)
+        except OSError:
+            return [], None
+        return [address for address in addresses if ip_to_int(address) is not None], ttl
+
+    def resolve_many(self, hosts: List[str], now: Optional[float] = None) -> Dict[str, List[str]]:
+        """
+        호스트들의 IPv4 주소 목록을 반환합니다. (조회되지 않은 호스트는 빈 목록)
+        캐시가 만료되지 않은 호스트는 다시 조회하지 않으며, 나머지는 동시에 조회합니다.
+        제한 시간 안에 끝나지 않은 조회는 실패로 처리하되 캐시에는 남기지 않습니다.
+        """
+        stage_metrics = metrics.current()
+        with self._lock, stage_metrics.timer('dns'):
+            now = time.time() if now is None else now
+            result: Dict[str, List[str]] = {}
+            missing = []
+            for host in dict.fromkeys(hosts):
+                cached = self.cache.get(host)
+                if ip_to_int(host) is not None:  # IP 주소는 조회하지 않습니다.
+                    result[host] = [host]
+                elif cached is not None and cached[1] > now:
+                    result[host] = cached[0]
+                    stage_metrics.add('dns_cache_hits')
+                else:
+                    missing.append(host)
+            if not missing:
+                return result
+
+            stage_metrics.add('dns_lookups', len(missing))
+            executor = ThreadPoolExecutor(max_workers=min(self.workers, len(missing)))
+            futures = {executor.submit(self._lookup, host): host for host in missing}
+            done, _ = wait(futures, timeout=self.timeout)
+            # getaddrinfo는 취소할 수 없으므로 끝나지 않은 조회를 기다리지 않습니다.
+            executor.shutdown(wait=False)
+            for future, host in futures.items():
+                if future not in done:
+                    result[host] = []
+                    continue
+                addresses, ttl = future.result()
+                result[host] = addresses
+                lifetime = (self.ttl if ttl is None else ttl) if addresses else self.negative_ttl
+                self.cache[host] = (addresses, now + lifetime)
+            stage_metrics.add('dns_unresolved', sum(1 for host in missing if not result[host]))
+            try:
+                self._save()
+            except OSError as e:
+                print(f"DNS 캐시 저장 중 오류 발생: {e}")
+            return result
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+_shared_resolver: Optional[HostResolver] = None
+_shared_lock = threading.Lock()
+
+
+def get_resolver() -> HostResolver:
+    """
+    모든 스크립트가 공유하는 HostResolver (환경 변수 설정).
+    DNS_HOSTS_FILE이 있으면 시스템 DNS 대신 그 파일로 조회하고 디스크 캐시를 쓰지 않습니다.
+    """
+    global _shared_resolver
+    with _shared_lock:
+        if _shared_resolver is None:
+            hosts_file = os.getenv('DNS_HOSTS_FILE')
+            _shared_resolver = HostResolver(
+                resolver=hosts_file_resolver(hosts_file) if hosts_file else None,
+                cache_path=None if hosts_file else CACHE_PATH,
+                ttl=_env_float('DNS_TTL', DEFAULT_TTL),
+                negative_ttl=_env_float('DNS_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL),
+                timeout=_env_float('DNS_TIMEOUT', DEFAULT_TIMEOUT),
+                workers=int(_env_float('DNS_WORKERS', DEFAULT_WORKERS)),
+            )
+        return _shared_resolver
+
+
+def plan_hosts(hosts: List[str], resolver: Optional[HostResolver] = None, policy: Optional[str] = None,
+               expand: Optional[bool] = None) -> List[Tuple[int, str]]:
+    """
+    고정 호스트 목록을 조회 결과에 따라 출력 순서로 정리합니다.
+
+    Args:
+        hosts: 고정 호스트(도메인 또는 IP) 목록.
+        resolver: 사용할 HostResolver (없으면 공유 조회기).
+        policy: 조회되지 않는 호스트 처리 방식 (없으면 FIXED_HOST_POLICY, 기본값 demote).
+        expand: True이면 호스트 대신 A 레코드 주소들을 출력합니다. 여러 호스트가 같은 주소를
+            가리키면 한 번만 출력합니다. (없으면 DNS_EXPAND=1 여부)
+
+    Returns:
+        List[Tuple[int, str]]: (입력 목록에서의 위치, 출력할 호스트 또는 주소) 목록.
+            모든 호스트가 조회되지 않으면 조회기 자체의 문제로 보고 입력 목록을 그대로 반환합니다.
+    """
+    policy = policy or os.getenv('FIXED_HOST_POLICY', DEFAULT_POLICY)
+    if policy not in POLICIES:
+        print(f"알 수 없는 FIXED_HOST_POLICY입니다: {policy} (기본값 {DEFAULT_POLICY} 사용)")
+        policy = DEFAULT_POLICY
+    expand = os.getenv('DNS_EXPAND') == '1' if expand is None else expand
+    unchanged = list(enumerate(hosts))
+    if policy == 'keep' or not hosts:
+        return unchanged
+
+    addresses = (resolver or get_resolver()).resolve_many(hosts)
+    if not any(addresses[host] for host in hosts if ip_to_int(host) is None):
+        print("고정 호스트가 하나도 조회되지 않아 (DNS 문제로 보고) 목록을 그대로 사용합니다.")
+        return unchanged
+
+    planned: List[Tuple[int, str]] = []
+    unresolved: List[Tuple[int, str]] = []
+    emitted = set()
+    for position, host in unchanged:
+        if not addresses[host]:
+            unresolved.append((position, host))
+        elif not expand:
+            planned.append((position, host))
+        else:
+            for address in addresses[host]:
+                if address not in emitted:
+                    emitted.add(address)
+                    planned.append((position, address))
+    if unresolved:
+        action = '목록 끝으로 옮깁니다' if policy == 'demote' else '제외합니다'
+        print(f"   - 조회되지 않는 고정 호스트 {len(unresolved)}개를 {action}: "
+              f"{', '.join(host for _, host in unresolved)}")
+    if policy == 'demote':
+        planned.extend(unresolved)
+    return planned
+
+
+if __name__ == "__main__":
+    # 사용 예: python host_resolver.py [호스트 ...] (호스트가 없으면 krlist/convert_proxies의 고정 목록)
+    targets = sys.argv[1:]
+    if not targets:
+        import convert_proxies
+        import krlist
+        targets = list(dict.fromkeys(
+            krlist.FIXED_HK_HOSTS + [line.split('#', 1)[0].rpartition(':')[0] for line in convert_proxies.FIXED_PROXIES]))
+    for host, found in get_resolver().resolve_many(targets).items():
+        print(f"{host}: {', '.join(found) or '조회 실패'}")
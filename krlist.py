@@ -1,5 +1,13 @@
+import os
 import requests
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from fetch_cache import fetch
+from host_resolver import plan_hosts
+from output_sink import write_lines_if_changed
+from proxy_index import LabelKey, ProxyIndex, hash_line, in_input_order, use_index
+from proxy_record import ProxyRecord
 
 # 사용자 요청에 따라 홍콩(HK) 목록에 고정으로 추가될 호스트 목록
 # 포트와 이름은 통일성을 위해 스크립트에서 추가됩니다.
@@ -34,8 +42,8 @@ def process_proxy_list_to_file(
 ):
     """
     주어진 URL에서 프록시 목록을 읽어와 지정된 국가 코드에 해당하는 줄만 필터링하고,
-    지정된 형식으로 변환하여 파일에 저장합니다. 이 함수는 파일을 'w' 모드로 열어 
-    기존 내용을 덮어씁니다. (고정 목록 추가를 위해 'w' 모드 유지)
+    지정된 형식으로 변환하여 파일에 저장합니다. 기존 내용은 원자적으로 교체되며,
+    내용이 같으면 파일을 다시 쓰지 않습니다.
 
     Args:
         url (str): 프록시 목록이 있는 URL.
@@ -56,23 +64,24 @@ def process_proxy_list_to_file(
 
         lines = response.text.splitlines()
 
-        # 2. 필터링 및 파일 저장 (w 모드로 덮어쓰기)
-        with open(output_filename, 'w', encoding='utf-8') as outfile:
-            for line in lines:
-                parts = line.strip().split(',')
-                
-                # 프록시 데이터가 'ip,port,country code,name' 4가지 구성인지 확인
-                if len(parts) == 4:
-                    ip = parts[0].strip()
-                    port = parts[1].strip()
-                    country_code = parts[2].strip()
-                    name = parts[3].strip()
-
-                    # 지정된 국가 코드 목록에 포함되는지 확인하여 필터링합니다.
-                    if country_code in target_countries:
-                        # 원하는 출력 형식으로 조합하여 파일에 씁니다. (예: 123.45.67.89:8080#KR Korea Proxy)
-                        outfile.write(f"{ip}:{port}#{country_code} {name}\n")
-                        dynamic_count += 1
+        # 2. 필터링 후 전체 결과를 한 번에 저장 (내용이 바뀐 경우에만 임시 파일 + 교체)
+        output_lines = []
+        for line in lines:
+            parts = line.strip().split(',')
+            
+            # 프록시 데이터가 'ip,port,country code,name' 4가지 구성인지 확인
+            if len(parts) == 4:
+                ip = parts[0].strip()
+                port = parts[1].strip()
+                country_code = parts[2].strip()
+                name = parts[3].strip()
+
+                # 지정된 국가 코드 목록에 포함되는지 확인하여 필터링합니다.
+                if country_code in target_countries:
+                    # 원하는 출력 형식으로 조합합니다. (예: 123.45.67.89:8080#KR Korea Proxy)
+                    output_lines.append(f"{ip}:{port}#{country_code} {name}\n")
+                    dynamic_count += 1
+        write_lines_if_changed(output_filename, output_lines)
         
         print(f"✅ URL에서 동적 목록을 성공적으로 가져왔습니다.")
         print(f"   - 총 {dynamic_count}개의 필터링된 동적 프록시 목록이 '{output_filename}'에 저장되었습니다.")
@@ -116,59 +125,163 @@ def append_fixed_entries(
     except Exception as e:
         print(f"❌ 고정 목록을 파일에 추가하는 중 오류가 발생했습니다: {e}")
         
+def _expected_line_count(layout: List[Tuple[Optional[LabelKey], str, str]], country_code: str) -> int:
+    """입력에서 국가 코드가 country_code인 줄 수 (완전히 같은 IPv4 줄은 한 번만 셉니다)"""
+    keys = set()
+    unindexed = 0
+    for key, country, _ in layout:
+        if country != country_code:
+            continue
+        if key is None:
+            unindexed += 1
+        else:
+            keys.add(key)
+    return len(keys) + unindexed
+
+def process_proxy_list_to_files(
+    url: str,
+    country_outputs: Dict[str, str],
+    fixed_entries: Optional[Dict[str, List[str]]] = None,
+    default_port: str = "443",
+    default_name: str = "CDN Host",
+    skip_if_unchanged: bool = False,
+    session=None,
+    index: Optional[ProxyIndex] = None
+) -> Dict[str, int]:
+    """
+    URL에서 프록시 목록을 한 번만 가져와 각 줄을 한 번만 파싱하여 공유 인덱스(ProxyIndex)에 병합한 뒤,
+    국가 코드별 필터로 해당하는 모든 출력 파일을 만듭니다. (fan-out 모드)
+    고정 호스트 목록(fixed_entries)은 DNS 조회 결과(host_resolver.plan_hosts)에 따라 정리되어
+    각 파일의 마지막에 병합됩니다.
+
+    국가를 추가해도 네트워크 요청과 파싱 횟수는 늘어나지 않습니다.
+
+    Args:
+        url (str): 프록시 목록이 있는 URL.
+        country_outputs (Dict[str, str]): 국가 코드 -> 출력 파일명 매핑.
+        fixed_entries (Dict[str, List[str]]): 국가 코드 -> 고정 호스트 목록 매핑.
+        default_port (str): 고정 호스트에 적용할 기본 포트.
+        default_name (str): 고정 호스트에 적용할 기본 이름.
+        skip_if_unchanged (bool): True이면 원본이 이전 실행과 같을 때(304 또는 같은 해시)
+            출력 파일이 모두 있는 경우 파싱과 저장을 건너뜁니다.
+        session: 재사용할 requests.Session (파이프라인에서 공유).
+        index: 병합할 인덱스 (없으면 이 호출에서만 쓰는 인덱스를 만듭니다).
+
+    Returns:
+        Dict[str, int]: 국가 코드별로 저장된 동적 프록시 개수. 건너뛴 경우 빈 dict.
+    """
+    if fixed_entries is None:
+        fixed_entries = {}
+    if index is None:
+        index = ProxyIndex()
+
+    dynamic_counts: Dict[str, int] = {country_code: 0 for country_code in country_outputs}
+    stage_metrics = metrics.current()
+
+    try:
+        # 1. 데이터 가져오기 (한 번만, ETag/Last-Modified 조건부 요청)
+        fetched = fetch(url, session=session, timeout=10)
+        if (skip_if_unchanged and not fetched.changed
+                and all(os.path.exists(path) for path in country_outputs.values())):
+            print("♻️ 원본 목록이 변경되지 않아 파싱과 저장을 건너뜁니다.")
+            index.touch(url)
+            return {}
+
+        # 2. 각 줄을 한 번만 파싱하여 인덱스에 병합 (출처 = URL, 완전히 같은 줄은 한 번만)
+        #    IPv4가 아닌 줄(도메인 등)은 인덱스에 넣지 않고 원래 위치에 그대로 출력합니다.
+        records: List[ProxyRecord] = []
+        layout: List[Tuple[Optional[LabelKey], str, str]] = []  # (인덱스 키, 국가 코드, 그대로 출력할 줄)
+        with stage_metrics.timer('parse'):
+            with fetched.open('r') as source:
+                lines = source.read().splitlines()
+            for line in lines:
+                record = ProxyRecord.from_csv_line(line)
+                if record is not None:
+                    records.append(record)
+                    layout.append(((record.ip, record.port, record.country, record.provider), record.country, ''))
+                    continue
+                parts = [part.strip() for part in line.strip().split(',')]
+                if len(parts) == 4:
+                    ip, port, code, name = parts
+                    layout.append((None, code, f"{ip}:{port}#{code} {name}"))
+            stage_metrics.add('rows_processed', len(lines))
+            stage_metrics.add('rows_merged', index.merge(url, records))
+
+        print("✅ URL에서 동적 목록을 성공적으로 가져왔습니다.")
+
+    except requests.exceptions.RequestException as e:
+        # 가져오기에 실패하면 기존 파일을 고정 목록만으로 덮어쓰지 않도록 그대로 둡니다.
+        print(f"❌ URL에서 데이터를 가져오는 중 오류가 발생했습니다: {e}")
+        return dynamic_counts
+    except Exception as e:
+        print(f"❌ 스크립트 실행 중 오류가 발생했습니다: {e}")
+        return dynamic_counts
+
+    # 3. 국가별 필터 + 고정 목록으로 파일별로 한 번에 저장 (내용이 바뀐 파일만 원자적으로 교체)
+    for country_code, output_filename in country_outputs.items():
+        selected = index.select(url, where=lambda entry, country, name, code=country_code: country == code)
+        rendered = {(entry.ip, entry.port, country, name): hash_line(entry, country, name)
+                    for entry, country, name in selected}
+        lines = in_input_order(((key, line) for key, country, line in layout
+                                if key is not None or country == country_code), rendered)
+        dynamic_counts[country_code] = len(lines)
+        # 같은 ip:port에 다른 국가 표기가 붙은 줄(예: KR 줄 뒤의 JP 줄)도 각 국가 파일에 모두 나와야 합니다.
+        expected = _expected_line_count(layout, country_code)
+        if len(lines) != expected:
+            print(f"⚠️ [{country_code}] 입력의 {expected}개 줄 중 {len(lines)}개만 출력됩니다.")
+        # 조회되지 않는 호스트는 FIXED_HOST_POLICY에 따라 뒤로 옮기거나 제외합니다.
+        hosts = [host for _, host in plan_hosts(fixed_entries.get(country_code, []))]
+        for host in hosts:
+            lines.append(f"{host}:{default_port}#{country_code} {default_name}")
+
+        try:
+            # 고정 목록까지 합친 전체 결과를 한 번에 교체하므로 읽는 쪽에서 중간 상태를 볼 수 없습니다.
+            with stage_metrics.timer('write'):
+                written = write_lines_if_changed(output_filename, lines)
+        except Exception as e:
+            print(f"❌ '{output_filename}' 파일 저장 중 오류가 발생했습니다: {e}")
+            continue
+        stage_metrics.add('files_written' if written else 'files_unchanged')
+
+        if not written:
+            print(f"   - [{country_code}] 내용이 같아 '{output_filename}' 파일을 다시 쓰지 않았습니다.")
+            continue
+        print(f"   - [{country_code}] 동적 {dynamic_counts[country_code]}개"
+              f" + 고정 {len(hosts)}개 항목이 '{output_filename}'에 저장되었습니다.")
+
+    return dynamic_counts
+
 # --- 스크립트 사용 방법 ---
-if __name__ == "__main__":
-    
-    proxy_list_url = "https://raw.githubusercontent.com/tedjo877/cek/refs/heads/main/update_proxyip.txt" 
-    print(f"🔗 데이터 출처 URL: {proxy_list_url}\n")
-
-    # 1. 한국(KR) 프록시 필터링
-    print("--- 1. 한국(KR) 프록시 필터링 시작 (출력: krlist.txt) ---")
-    process_proxy_list_to_file(
-        url=proxy_list_url, 
-        output_filename="krlist.txt", 
-        target_countries=['KR']
-    )
-    
-    # 2. 홍콩(HK) 프록시 필터링 + 고정 목록 추가 (요청 사항 반영)
-    print("\n--- 2. 홍콩(HK) 프록시 필터링 및 고정 목록 추가 시작 (출력: hklist.txt) ---")
-    
-    # 2-1. 동적 목록 필터링 (파일 덮어쓰기)
-    process_proxy_list_to_file(
-        url=proxy_list_url, 
-        output_filename="hklist.txt", 
-        target_countries=['HK']
-    )
-    
-    # 2-2. 고정 목록 추가 (파일 이어쓰기)
-    append_fixed_entries(
-        output_filename="hklist.txt",
-        hosts=FIXED_HK_HOSTS,
-        country_code='HK'
-    )
-
-    # 3. 일본(JP) 프록시 필터링
-    print("\n--- 3. 일본(JP) 프록시 필터링 시작 (출력: jplist.txt) ---")
-    process_proxy_list_to_file(
-        url=proxy_list_url, 
-        output_filename="jplist.txt", 
-        target_countries=['JP']
-    )
-    
-    # 4. 싱가포르(SG) 프록시 필터링
-    print("\n--- 4. 싱가포르(SG) 프록시 필터링 시작 (출력: sglist.txt) ---")
-    process_proxy_list_to_file(
-        url=proxy_list_url, 
-        output_filename="sglist.txt", 
-        target_countries=['SG']
-    )
-
-    # 5. 대만(TW) 프록시 필터링
-    print("\n--- 5. 대만(TW) 프록시 필터링 시작 (출력: twlist.txt) ---")
-    process_proxy_list_to_file(
-        url=proxy_list_url, 
-        output_filename="twlist.txt", 
-        target_countries=['TW']
-    )
+PROXY_LIST_URL = "https://raw.githubusercontent.com/tedjo877/cek/refs/heads/main/update_proxyip.txt"
+
+# 국가 코드 -> 출력 파일 매핑. 국가를 추가해도 다운로드/파싱은 한 번뿐입니다.
+COUNTRY_OUTPUTS = {
+    'KR': "krlist.txt",
+    'HK': "hklist.txt",
+    'JP': "jplist.txt",
+    'SG': "sglist.txt",
+    'TW': "twlist.txt",
+}
+
+def main(session=None, index=None):
+    """국가별 목록 생성 (pipeline.py에서 공유 세션, 공유 인덱스와 함께 호출할 수 있습니다)"""
+    print(f"🔗 데이터 출처 URL: {PROXY_LIST_URL}\n")
+
+    print("--- KR/HK/JP/SG/TW 프록시 필터링 시작 (단일 다운로드, fan-out) ---")
+    with use_index(index) as index:
+        process_proxy_list_to_files(
+            url=PROXY_LIST_URL,
+            country_outputs=COUNTRY_OUTPUTS,
+            # 홍콩(HK) 목록에는 고정 호스트 목록을 마지막에 추가합니다. (요청 사항 반영)
+            fixed_entries={'HK': FIXED_HK_HOSTS},
+            skip_if_unchanged=True,
+            session=session,
+            index=index,
+        )
     
     print("\n--- 모든 필터링 작업이 완료되었습니다. ---")
+
+if __name__ == "__main__":
+    with metrics.stage('krlist'):
+        main()
+    metrics.write_summary()
@@ -0,0 +1,246 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+from output_sink import write_text_if_changed
+
+# 실행 요약(JSON)을 저장할 파일 (METRICS_FILE 환경 변수로 변경, 빈 문자열이면 저장하지 않음)
+DEFAULT_METRICS_FILE = 'run_metrics.json'
+
+# cProfile 결과(.prof)를 저장할 디렉터리 (git에는 포함하지 않음)
+PROFILE_DIR = os.path.join('.cache', 'profile')
+
+# 지연 시간 히스토그램의 버킷 상한(ms). 마지막 버킷은 그보다 큰 값 전부입니다.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# 줄 단위 로그("ip:port is ALIVE" 등)는 VERBOSE=1일 때만 출력합니다.
+# (대량 검사 시 여러 스레드가 stdout을 두고 경쟁하지 않도록)
+_verbose = os.getenv('VERBOSE') == '1'
+
+
+def set_verbose(enabled: bool):
+    global _verbose
+    _verbose = enabled
+
+
+def is_verbose() -> bool:
+    return _verbose
+
+
+def verbose_print(message: str):
+    """VERBOSE 모드일 때만 출력하는 줄 단위 로그"""
+    if _verbose:
+        print(message)
+
+
+class Histogram:
+    """고정 버킷 히스토그램 (개수/합계/최소/최대와 버킷 상한 기준 근사 백분위수)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return float(self.buckets[index]) if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.50),
+            'p90': self.percentile(0.90),
+            'p99': self.percentile(0.99),
+            'buckets': {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class StageMetrics:
+    """
+    단계(스크립트) 하나의 측정값: 구간별(fetch/parse/check/write 등) 소요 시간과 호출 횟수,
+    카운터(다운로드 바이트, 처리한 행 수 등), 히스토그램.
+    여러 스레드에서 기록할 수 있도록 잠금을 사용합니다.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timings: Dict[str, list] = {}
+        self.counters: Counter = Counter()
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                timing = self.timings.setdefault(phase, [0.0, 0])
+                timing[0] += elapsed
+                timing[1] += 1
+
+    def add(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def observe(self, histogram: str, value: float):
+        with self._lock:
+            target = self.histograms.get(histogram)
+            if target is None:
+                target = self.histograms[histogram] = Histogram()
+            target.observe(value)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'timings_s': {phase: {'seconds': round(seconds, 4), 'calls': calls}
+                              for phase, (seconds, calls) in self.timings.items()},
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            }
+
+
+_stages: Dict[str, StageMetrics] = {}
+_stages_lock = threading.Lock()
+_local = threading.local()
+_started_at = datetime.now()
+
+
+def stage_metrics(name: str) -> StageMetrics:
+    """이름에 해당하는 단계의 측정값 (없으면 만듭니다)"""
+    with _stages_lock:
+        metrics = _stages.get(name)
+        if metrics is None:
+            metrics = _stages[name] = StageMetrics(name)
+        return metrics
+
+
+def current() -> StageMetrics:
+    """현재 스레드에서 실행 중인 단계의 측정값 (stage() 밖이면 'main')"""
+    return getattr(_local, 'stage', None) or stage_metrics('main')
+
+
+# 한 번에 하나의 단계만 프로파일합니다 (profiled 참고).
+_profile_lock = threading.Lock()
+
+
+def _profiled_stages():
+    return {name.strip() for name in os.getenv('PROFILE_STAGES', '').split(',') if name.strip()}
+
+
+@contextmanager
+def profiled(name: str) -> Iterator[None]:
+    """
+    PROFILE_STAGES(쉼표 구분, 'all'이면 전체)에 포함된 단계만 cProfile로 감쌉니다.
+    결과는 PROFILE_DIR/<단계>.prof에 저장하고 누적 시간 상위 15개 함수를 출력합니다.
+    동시에 실행되는 단계는 하나만 프로파일됩니다.
+    """
+    wanted = _profiled_stages()
+    if name not in wanted and 'all' not in wanted:
+        yield
+        return
+
+    # Python 3.12부터 cProfile은 프로세스 전체에서 하나만 켤 수 있으므로 (두 번째는
+    # "Another profiling tool is already active" ValueError), 동시에 실행되는 단계 중
+    # 먼저 시작한 단계만 프로파일하고 나머지는 경고 후 그대로 실행합니다.
+    if not _profile_lock.acquire(blocking=False):
+        print(f"[profile] {name}: 다른 단계를 프로파일하는 중이라 건너뜁니다. "
+              "PROFILE_STAGES에 한 단계만 지정하세요.")
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # 다른 프로파일러(외부 도구 등)가 이미 켜져 있는 경우
+        _profile_lock.release()
+        print(f"[profile] {name}: 프로파일을 시작할 수 없어 건너뜁니다 ({e}).")
+        profiler = None
+    if profiler is None:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profile_lock.release()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}.prof")
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(15)
+        print(f"[profile] {name} -> {path}\n{report.getvalue()}")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[StageMetrics]:
+    """
+    현재 스레드를 단계 name으로 표시하고 전체 소요 시간('total')을 측정합니다.
+    (fetch_cache 등 공용 모듈은 current()로 이 단계에 기록합니다.)
+    """
+    metrics = stage_metrics(name)
+    previous = getattr(_local, 'stage', None)
+    _local.stage = metrics
+    try:
+        with profiled(name), metrics.timer('total'):
+            yield metrics
+    finally:
+        _local.stage = previous
+
+
+def summary() -> Dict:
+    with _stages_lock:
+        stages = dict(_stages)
+    return {
+        'run_at': _started_at.isoformat(timespec='seconds'),
+        'stages': {name: metrics.to_dict() for name, metrics in stages.items()},
+    }
+
+
+def write_summary(path: Optional[str] = None) -> Optional[str]:
+    """
+    모든 단계의 측정값을 JSON 파일로 저장합니다. (실행 끝에 한 번 호출)
+
+    Returns:
+        Optional[str]: 저장한 경로. METRICS_FILE이 빈 문자열이면 None.
+    """
+    path = os.getenv('METRICS_FILE', DEFAULT_METRICS_FILE) if path is None else path
+    if not path:
+        return None
+    write_text_if_changed(path, json.dumps(summary(), ensure_ascii=False, indent=2) + '\n')
+    return path
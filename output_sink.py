@@ -0,0 +1,58 @@
+import hashlib
+import os
+import tempfile
+from typing import Iterable
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_text_if_changed(path: str, content: str) -> bool:
+    """
+    전체 결과를 기존 파일과 비교하여 내용이 다를 때만 씁니다.
+    임시 파일에 먼저 쓴 뒤 os.replace로 교체하므로 읽는 쪽에서 절반만 쓰인 목록을 보지 않습니다.
+
+    Args:
+        path: 출력 파일 경로.
+        content: 파일 전체 내용.
+
+    Returns:
+        bool: 파일을 새로 썼으면 True, 내용이 같아 건너뛰었으면 False.
+    """
+    data = content.encode('utf-8')
+
+    # 크기가 같을 때만 해시를 비교합니다. (크기가 다르면 바로 변경으로 판단)
+    try:
+        if os.path.getsize(path) == len(data) and _file_digest(path) == hashlib.sha256(data).hexdigest():
+            return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # 기존 파일의 권한을 유지합니다. (mkstemp는 0600으로 만듭니다)
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return True
+
+
+def write_lines_if_changed(path: str, lines: Iterable[str]) -> bool:
+    """각 줄 끝에 줄바꿈을 붙여 write_text_if_changed로 저장합니다."""
+    return write_text_if_changed(path, ''.join(line if line.endswith('\n') else line + '\n' for line in lines))
@@ -0,0 +1,89 @@
+import argparse
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import metrics
+from checker_client import make_session
+from proxy_index import ProxyIndex
+
+# 실행할 생산 단계(모듈 이름). 각 모듈은 main(session=None, index=None)을 제공합니다.
+STAGES: List[str] = ['krlist', 'convert_proxies', 'cfproxyip']
+
+
+def run_stage(name: str, session, index: Optional[ProxyIndex] = None) -> float:
+    """
+    단계 모듈을 필요할 때 import하여(yaml 등은 해당 단계에서만 로드) main()을 실행하고
+    걸린 시간(초)을 반환합니다.
+    """
+    start = time.perf_counter()
+    with metrics.stage(name):
+        module = importlib.import_module(name)
+        module.main(session=session, index=index)
+    return time.perf_counter() - start
+
+
+def run_pipeline(stages: Optional[List[str]] = None) -> Dict[str, Optional[float]]:
+    """
+    생산 단계들을 한 프로세스 안에서 동시에 실행합니다.
+    각 단계는 대부분 네트워크 대기이므로 전체 소요 시간은 가장 느린 단계에 가까워집니다.
+    모든 단계는 하나의 ProxyIndex에 병합하고 그 인덱스에서 출력 파일을 만들며,
+    인덱스(출처, 마지막 확인 시각, 검사 상태)는 실행이 끝나면 저장됩니다.
+
+    Returns:
+        Dict[str, Optional[float]]: 단계별 소요 시간(초). 실패한 단계는 None.
+    """
+    stages = stages or STAGES
+    timings: Dict[str, Optional[float]] = {}
+    session = make_session(pool_size=len(stages) * 2)
+    pipeline_metrics = metrics.stage_metrics('pipeline')
+    with pipeline_metrics.timer('index_load'):
+        index = ProxyIndex.load()
+        index.apply_check_cache(os.getenv('CHECK_CACHE', 'proxy_check_cache.sqlite3'))
+
+    start = time.perf_counter()
+    with session, ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        futures = {name: executor.submit(run_stage, name, session, index) for name in stages}
+        for name, future in futures.items():
+            try:
+                timings[name] = future.result()
+            except Exception as e:
+                print(f"❌ [{name}] 단계 실행 중 오류가 발생했습니다: {e}")
+                timings[name] = None
+    total = time.perf_counter() - start
+
+    try:
+        with pipeline_metrics.timer('index_save'):
+            index.save()
+    except OSError as e:
+        print(f"❌ 인덱스 저장 중 오류가 발생했습니다: {e}")
+
+    print("\n--- 파이프라인 단계별 소요 시간 ---")
+    for name in stages:
+        elapsed = timings[name]
+        print(f"   - {name:<16} {'실패' if elapsed is None else f'{elapsed:.2f}초'}")
+    print(f"   - {'전체(wall clock)':<16} {total:.2f}초")
+    print(f"   - 인덱스 항목 {len(index)}개, 출처 {len(index.source_runs)}개")
+
+    metrics_path = metrics.write_summary()
+    if metrics_path:
+        print(f"   - 단계별 측정값: {metrics_path}")
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="krlist / convert_proxies / cfproxyip 단계를 한 프로세스에서 동시에 실행합니다.")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"실행할 단계 목록 (기본값: {','.join(STAGES)})")
+    args = parser.parse_args(argv)
+
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    timings = run_pipeline(stages)
+    return 1 if any(elapsed is None for elapsed in timings.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
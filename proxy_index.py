@@ -0,0 +1,303 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from check_cache import CheckCache
+from output_sink import write_lines_if_changed
+from proxy_record import ProxyRecord, int_to_ip, ip_to_int
+
+# 실행 사이에 인덱스(출처, 마지막 확인 시각, 검사 상태)를 보관할 파일 (git에는 포함하지 않음)
+INDEX_PATH = os.path.join('.cache', 'index.json')
+
+# 어느 출처에서도 이 기간 동안 보이지 않은 항목은 저장할 때 버립니다.
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+Key = Tuple[int, int]
+# 출처 안에서 줄 하나를 가리키는 키: (IPv4 정수, 포트, 국가 코드, 이름)
+LabelKey = Tuple[int, int, str, str]
+# 출처에서 붙인 표기: (출처 안에서의 순서, 국가 코드, 이름)
+Label = Tuple[int, str, str]
+
+
+class IndexEntry:
+    """
+    (IPv4 정수, 포트) 하나에 대한 항목.
+    sources에는 출처별로 (마지막 확인 시각, 표기 목록)을 기록합니다. 한 출처 안에서도 같은
+    엔드포인트에 서로 다른 표기(예: KR과 JP)가 붙을 수 있으므로 표기마다 순서를 따로 보관합니다.
+    """
+    __slots__ = ('ip', 'port', 'sources', 'status', 'latency_ms', 'checked_at')
+
+    def __init__(self, ip: int, port: int):
+        self.ip = ip
+        self.port = port
+        self.sources: Dict[str, Tuple[float, List[Label]]] = {}
+        self.status: Optional[bool] = None  # 마지막 검사 결과 (True 살아있음, False 죽음, None 미검사)
+        self.latency_ms: Optional[float] = None
+        self.checked_at: Optional[float] = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"{int_to_ip(self.ip)}:{self.port}"
+
+    @property
+    def last_seen(self) -> float:
+        return max((seen for seen, _ in self.sources.values()), default=0.0)
+
+    def labels(self, source: str) -> List[Tuple[str, str]]:
+        """출처에서 붙인 (국가 코드, 이름) 목록 (출처의 순서대로)"""
+        _, labels = self.sources[source]
+        return [(country, name) for _, country, name in labels]
+
+
+# 출력 형식 함수: (항목, 국가 코드, 이름) -> 출력 줄
+Formatter = Callable[[IndexEntry, str, str], str]
+
+
+def hash_line(entry: IndexEntry, country: str, name: str) -> str:
+    """'ip:port#CC name' 형식"""
+    return f"{entry.endpoint}#{country} {name}".rstrip()
+
+
+class ProxyIndex:
+    """
+    모든 출처(ip.txt, update_proxyip.txt, all.txt, 구독 YAML 등)의 프록시를 하나로 모은 인덱스.
+    각 출력 파일은 이 인덱스에 대한 필터(출처/국가/검사 상태)와 형식 함수로 만들어집니다.
+    파이프라인 단계들이 동시에 병합하므로 변경은 잠금 안에서 수행합니다.
+    """
+
+    def __init__(self):
+        self.entries: Dict[Key, IndexEntry] = {}
+        # 출처별 마지막 병합 시각. 이 시각에 확인된 항목만 해당 출처의 현재 목록입니다.
+        self.source_runs: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def merge(self, source: str, records: Iterable[ProxyRecord], seen_at: Optional[float] = None) -> int:
+        """
+        출처 하나의 레코드들을 병합합니다. 같은 출처 안에서 엔드포인트와 표기(국가 코드, 이름)가
+        모두 같은 줄은 처음 것만 남기고, 표기가 다르면 (예: 같은 ip:port의 KR 줄과 JP 줄) 모두 남깁니다.
+
+        Returns:
+            int: 병합된(중복 제외) 줄 수.
+        """
+        seen_at = time.time() if seen_at is None else seen_at
+        count = 0
+        with self._lock:
+            entries = self.entries
+            for record in records:
+                key = (record.ip, record.port)
+                entry = entries.get(key)
+                if entry is None:
+                    entry = entries[key] = IndexEntry(record.ip, record.port)
+                info = entry.sources.get(source)
+                if info is None or info[0] != seen_at:
+                    labels: List[Label] = []
+                    entry.sources[source] = (seen_at, labels)
+                else:
+                    labels = info[1]
+                    if any(country == record.country and name == record.provider
+                           for _, country, name in labels):
+                        continue
+                labels.append((count, record.country, record.provider))
+                count += 1
+            self.source_runs[source] = seen_at
+        return count
+
+    def touch(self, source: str, seen_at: Optional[float] = None):
+        """출처 내용이 바뀌지 않았을 때(다시 파싱하지 않고) 현재 목록의 확인 시각만 갱신합니다."""
+        seen_at = time.time() if seen_at is None else seen_at
+        with self._lock:
+            previous = self.source_runs.get(source)
+            if previous is None:
+                return
+            for entry in self.entries.values():
+                info = entry.sources.get(source)
+                if info is not None and info[0] == previous:
+                    entry.sources[source] = (seen_at, info[1])
+            self.source_runs[source] = seen_at
+
+    def record_check(self, endpoint: str, status: Optional[bool], latency_ms: Optional[float] = None,
+                     checked_at: Optional[float] = None):
+        """
+        'ip:port' 엔드포인트의 검사 결과를 기록합니다. (인덱스에 없는 엔드포인트는 무시)
+        잠금을 잡지 않으므로 단계들이 동시에 실행되기 전이나 잠금 안에서 호출합니다.
+        """
+        ip, _, port = endpoint.rpartition(':')
+        ip_value = ip_to_int(ip)
+        if ip_value is None or not port.isdigit():
+            return
+        entry = self.entries.get((ip_value, int(port)))
+        if entry is None:
+            return
+        entry.status = status
+        entry.latency_ms = latency_ms if status else None
+        entry.checked_at = time.time() if checked_at is None else checked_at
+
+    def apply_check_cache(self, cache_path: str) -> int:
+        """
+        update_proxy_status.py의 검사 캐시(SQLite)에 있는 마지막 결과를 항목에 반영합니다.
+        캐시 파일이 없으면 아무것도 하지 않습니다.
+
+        Returns:
+            int: 반영된 캐시 행 수.
+        """
+        if not cache_path or not os.path.exists(cache_path):
+            return 0
+        count = 0
+        with CheckCache(cache_path) as cache, self._lock:
+            for endpoint, status, checked_at, latency_ms in cache.entries():
+                if status is None:  # 검사기 오류는 상태로 취급하지 않습니다.
+                    continue
+                self.record_check(endpoint, bool(status), latency_ms, checked_at)
+                count += 1
+        return count
+
+    def select(
+        self,
+        source: str,
+        where: Optional[Callable[[IndexEntry, str, str], bool]] = None,
+        order: str = 'source',
+    ) -> List[Tuple[IndexEntry, str, str]]:
+        """
+        출처의 현재 목록에서 조건에 맞는 (항목, 국가 코드, 이름)을 반환합니다.
+        한 항목에 표기가 여러 개이면 표기마다 하나씩 반환합니다.
+
+        Args:
+            source: 출처 이름.
+            where: (항목, 국가 코드, 이름)을 받아 포함 여부를 돌려주는 필터.
+            order: 'source'(출처의 원래 순서), 'ip'(IP 순, 같은 IP는 출처의 순서),
+                'latency'(측정 지연 시간이 짧은 순, 측정값이 없으면 뒤에 IP 순).
+        """
+        current = self.source_runs.get(source)
+        if current is None:
+            return []
+        with self._lock:
+            selected = []
+            for entry in self.entries.values():
+                info = entry.sources.get(source)
+                if info is None or info[0] != current:
+                    continue
+                for position, country, name in info[1]:
+                    if where is None or where(entry, country, name):
+                        selected.append((position, entry, country, name))
+
+        if order == 'source':
+            selected.sort(key=lambda item: item[0])
+        else:
+            selected.sort(key=lambda item: (item[1].ip, item[0]))
+            if order == 'latency':
+                selected.sort(key=lambda item: (item[1].latency_ms is None, item[1].latency_ms or 0))
+        return [(entry, country, name) for _, entry, country, name in selected]
+
+    def render_lines(self, source: str, formatter: Formatter = hash_line, where=None,
+                     order: str = 'source') -> List[str]:
+        return [formatter(entry, country, name) for entry, country, name in self.select(source, where, order)]
+
+    def render(self, path: str, source: str, formatter: Formatter = hash_line, where=None,
+               order: str = 'source', tail: Iterable[str] = ()) -> bool:
+        """
+        출처의 현재 목록을 형식 함수로 출력하고 고정 줄(tail)을 덧붙여 저장합니다.
+        내용이 같으면 파일을 다시 쓰지 않습니다.
+
+        Returns:
+            bool: 파일을 새로 썼으면 True.
+        """
+        lines = self.render_lines(source, formatter, where, order)
+        lines.extend(tail)
+        return write_lines_if_changed(path, lines)
+
+    def prune(self, max_age: float = DEFAULT_MAX_AGE, now: Optional[float] = None) -> int:
+        """어느 출처에서도 max_age(초) 동안 보이지 않은 항목을 지웁니다."""
+        now = time.time() if now is None else now
+        with self._lock:
+            stale = [key for key, entry in self.entries.items() if now - entry.last_seen > max_age]
+            for key in stale:
+                del self.entries[key]
+        return len(stale)
+
+    def save(self, path: str = INDEX_PATH, max_age: float = DEFAULT_MAX_AGE):
+        """인덱스를 JSON으로 저장합니다. (임시 파일에 쓴 뒤 교체)"""
+        self.prune(max_age)
+        with self._lock:
+            data = {
+                'version': 2,
+                'source_runs': self.source_runs,
+                'entries': [
+                    [entry.ip, entry.port, entry.sources, entry.status, entry.latency_ms, entry.checked_at]
+                    for entry in self.entries.values()
+                ],
+            }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = INDEX_PATH) -> 'ProxyIndex':
+        """저장된 인덱스를 불러옵니다. 파일이 없거나 읽을 수 없으면 빈 인덱스를 반환합니다."""
+        index = cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return index
+        except (OSError, ValueError) as e:
+            print(f"인덱스 파일을 읽지 못해 새로 만듭니다 ({path}): {e}")
+            return index
+        if data.get('version') != 2:
+            return index
+
+        index.source_runs = data['source_runs']
+        for ip, port, sources, status, latency_ms, checked_at in data['entries']:
+            entry = IndexEntry(ip, port)
+            entry.sources = {source: (seen_at, [tuple(label) for label in labels])
+                             for source, (seen_at, labels) in sources.items()}
+            entry.status = status
+            entry.latency_ms = latency_ms
+            entry.checked_at = checked_at
+            index.entries[(ip, port)] = entry
+        return index
+
+
+def in_input_order(layout: Iterable[Tuple[Optional[LabelKey], Any]], rendered: Dict[LabelKey, Any]) -> List[Any]:
+    """
+    인덱스에서 고른 항목과 인덱스에 넣지 않은 줄(IPv4가 아닌 호스트 등)을 입력 순서대로 합칩니다.
+
+    Args:
+        layout: 입력 순서대로의 (키, 값) 목록. 키가 (IPv4 정수, 포트, 국가 코드, 이름)이면 rendered의 값을 출력하고
+            (필터에서 빠졌거나 이미 출력한 키는 건너뜀), 키가 None이면 값을 그대로 출력합니다.
+        rendered: 키 -> 출력할 값 (ProxyIndex.select 결과로 만든 것).
+
+    Returns:
+        List[Any]: 출력할 값 목록.
+    """
+    remaining = dict(rendered)
+    output = []
+    for key, value in layout:
+        if key is None:
+            output.append(value)
+        elif key in remaining:
+            output.append(remaining.pop(key))
+    return output
+
+
+@contextmanager
+def use_index(index: Optional[ProxyIndex] = None):
+    """
+    단계의 main()에서 사용할 인덱스.
+    파이프라인이 넘겨준 인덱스가 있으면 그대로 사용하고, 단독 실행이면 저장된 인덱스를 불러와
+    검사 캐시(CHECK_CACHE)의 결과를 반영한 뒤 끝나면 저장합니다.
+    """
+    if index is not None:
+        yield index
+        return
+    index = ProxyIndex.load()
+    index.apply_check_cache(os.getenv('CHECK_CACHE', 'proxy_check_cache.sqlite3'))
+    yield index
+    index.save()
@@ -0,0 +1,65 @@
+import csv
+import sys
+from typing import Optional
+
+
+def ip_to_int(ip: str) -> Optional[int]:
+    """IPv4 문자열을 uint32 정수로 변환합니다. IPv4가 아니면 None을 반환합니다."""
+    try:
+        parts = list(map(int, ip.split('.')))
+    except ValueError:
+        return None
+    if len(parts) != 4 or not all(0 <= part <= 255 for part in parts):
+        return None
+    return (parts[0] << 24) | (parts[1] << 16) | (parts[2] << 8) | parts[3]
+
+
+def int_to_ip(value: int) -> str:
+    """uint32 정수를 IPv4 문자열로 변환합니다."""
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+class ProxyRecord:
+    """
+    모든 스크립트가 공유하는 프록시 레코드.
+    IPv4는 uint32 정수, 포트는 정수, 국가 코드와 제공자 이름은 intern된 문자열로 보관합니다.
+    """
+    __slots__ = ('ip', 'port', 'country', 'provider')
+
+    def __init__(self, ip: int, port: int, country: str = '', provider: str = ''):
+        self.ip = ip
+        self.port = port
+        self.country = sys.intern(country)
+        self.provider = sys.intern(provider)
+
+    def __repr__(self) -> str:
+        return f"ProxyRecord({self.endpoint!r}, {self.country!r}, {self.provider!r})"
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, ProxyRecord) and
+                (self.ip, self.port, self.country, self.provider) ==
+                (other.ip, other.port, other.country, other.provider))
+
+    def __hash__(self) -> int:
+        return hash((self.ip, self.port))
+
+    @property
+    def ip_str(self) -> str:
+        return int_to_ip(self.ip)
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.ip_str}:{self.port}"
+
+    @classmethod
+    def from_csv_line(cls, line: str) -> Optional['ProxyRecord']:
+        """'ip,port,country,name' 형식 (ip.txt, proxy.txt, update_proxyip.txt)"""
+        # 따옴표가 있는 필드("A, ""B""")만 csv 모듈로 파싱합니다.
+        parts = next(csv.reader([line])) if '"' in line else line.strip().split(',')
+        if len(parts) != 4:
+            return None
+        ip = ip_to_int(parts[0].strip())
+        port = parts[1].strip()
+        if ip is None or not port.isdigit() or not 0 < int(port) < 65536:
+            return None
+        return cls(ip, int(port), parts[2].strip(), parts[3].strip())
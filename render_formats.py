@@ -0,0 +1,214 @@
+import base64
+import json
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, unquote, urlencode, urlsplit
+
+from output_sink import write_lines_if_changed, write_text_if_changed
+
+# 만들 출력 형식 (RENDER_FORMATS 환경 변수, 쉼표 구분)
+# text: 기존 'ip:port#라벨' 목록, clash: Clash 'proxies:' YAML, base64: 공유 링크 구독(base64)
+FORMATS = ('text', 'clash', 'base64')
+DEFAULT_FORMATS = 'text'
+
+# text 출력 파일의 확장자를 바꿔 다른 형식의 파일 이름을 만듭니다. (converted_proxies.txt -> converted_proxies.yaml)
+EXTENSIONS = {'clash': '.yaml', 'base64': '.b64'}
+
+# 공유 링크로 읽을 수 있는 프로토콜
+SHARE_LINK_TYPES = ('trojan', 'vless')
+
+
+class OutputNode(NamedTuple):
+    """
+    출력 한 줄에 해당하는 노드. address는 'host:port', label은 '#' 뒤의 표기입니다.
+    raw가 있으면 형식을 알 수 없는 줄이므로 text 출력에만 그대로 씁니다.
+    """
+    address: str
+    label: str
+    raw: Optional[str] = None
+
+    @classmethod
+    def passthrough(cls, line: str) -> 'OutputNode':
+        return cls('', '', line)
+
+    @property
+    def text(self) -> str:
+        return self.raw if self.raw is not None else f"{self.address}#{self.label}"
+
+    def endpoint(self) -> Optional[Tuple[str, int]]:
+        """(host, port). 형식을 알 수 없는 줄이면 None."""
+        if self.raw is not None:
+            return None
+        host, _, port = self.address.rpartition(':')
+        if not host or not port.isdigit() or not 0 < int(port) < 65536:
+            return None
+        return host.strip('[]'), int(port)
+
+
+class NodeTemplate(NamedTuple):
+    """
+    clash/base64 출력에 쓰는 노드 공통 설정 (프록시 목록에는 주소만 있으므로 나머지는 여기서 채웁니다).
+    type은 'trojan' 또는 'vless', secret은 trojan 비밀번호 또는 vless UUID입니다. (전송은 TLS + WebSocket)
+    """
+    type: str
+    secret: str
+    sni: str
+    host: str
+    path: str
+
+    @classmethod
+    def from_env(cls) -> Optional['NodeTemplate']:
+        """NODE_TYPE, NODE_SECRET, NODE_SNI, NODE_HOST, NODE_PATH 환경 변수. NODE_SECRET이 없으면 None."""
+        secret = os.getenv('NODE_SECRET', '')
+        if not secret:
+            return None
+        node_type = os.getenv('NODE_TYPE', 'trojan').lower()
+        if node_type not in SHARE_LINK_TYPES:
+            print(f"지원하지 않는 NODE_TYPE입니다: {node_type} (trojan 또는 vless)")
+            return None
+        host = os.getenv('NODE_HOST', '')
+        sni = os.getenv('NODE_SNI', '') or host
+        return cls(node_type, secret, sni, host or sni, os.getenv('NODE_PATH', '/'))
+
+
+def parse_formats(value: Optional[str] = None) -> List[str]:
+    """RENDER_FORMATS 값을 형식 목록으로 변환합니다. (알 수 없는 이름은 무시하고 text는 항상 포함)"""
+    value = os.getenv('RENDER_FORMATS', DEFAULT_FORMATS) if value is None else value
+    wanted = {name.strip().lower() for name in value.split(',') if name.strip()}
+    for name in sorted(wanted - set(FORMATS)):
+        print(f"알 수 없는 출력 형식은 무시합니다: {name}")
+    return [name for name in FORMATS if name in wanted or name == 'text']
+
+
+def format_path(text_path: str, fmt: str) -> str:
+    """text 출력 파일 경로에 대응하는 형식별 파일 경로"""
+    if fmt == 'text':
+        return text_path
+    return os.path.splitext(text_path)[0] + EXTENSIONS[fmt]
+
+
+def _yaml_flow(value: Any) -> str:
+    """값을 YAML 흐름(flow) 표기로 변환합니다. 문자열은 JSON 문자열(=YAML 큰따옴표 문자열)로 씁니다."""
+    if isinstance(value, dict):
+        return '{' + ', '.join(f"{key}: {_yaml_flow(item)}" for key, item in value.items()) + '}'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def clash_proxy(name: str, host: str, port: int, template: NodeTemplate) -> Dict[str, Any]:
+    """Clash 'proxies:' 항목 하나"""
+    proxy: Dict[str, Any] = {'name': name, 'type': template.type, 'server': host, 'port': port}
+    if template.type == 'trojan':
+        proxy['password'] = template.secret
+        proxy['sni'] = template.sni
+    else:
+        proxy['uuid'] = template.secret
+        proxy['tls'] = True
+        proxy['servername'] = template.sni
+    proxy['udp'] = False
+    proxy['skip-cert-verify'] = True
+    proxy['network'] = 'ws'
+    proxy['ws-opts'] = {'path': template.path, 'headers': {'Host': template.host}}
+    return proxy
+
+
+def share_link(name: str, host: str, port: int, template: NodeTemplate) -> str:
+    """'trojan://' / 'vless://' 공유 링크 하나"""
+    params = {'security': 'tls', 'sni': template.sni, 'type': 'ws', 'host': template.host, 'path': template.path}
+    if template.type == 'vless':
+        params = {'encryption': 'none', **params}
+    server = f"[{host}]" if ':' in host else host
+    return (f"{template.type}://{quote(template.secret, safe='')}@{server}:{port}"
+            f"?{urlencode(params, quote_via=quote)}#{quote(name, safe='')}")
+
+
+def render_outputs(nodes: Iterable[OutputNode], text_path: str, formats: Optional[List[str]] = None,
+                   template: Optional[NodeTemplate] = None) -> Dict[str, bool]:
+    """
+    노드 목록을 한 번만 순회하면서 요청한 모든 형식의 출력을 만들고 저장합니다.
+    (형식마다 원본을 다시 파싱하거나 외부 변환 서비스를 거치지 않습니다.)
+    clash/base64 노드 이름은 '라벨 host:port'이며 Clash에서 이름이 겹치지 않도록 필요하면 번호를 붙입니다.
+
+    Args:
+        nodes: 출력할 노드 (text 출력 순서 그대로).
+        text_path: text 출력 파일 경로. 다른 형식은 확장자만 바꿔 저장합니다.
+        formats: 형식 목록 (없으면 RENDER_FORMATS 환경 변수).
+        template: clash/base64에 쓸 노드 설정 (없으면 환경 변수, 그것도 없으면 두 형식을 건너뜀).
+
+    Returns:
+        Dict[str, bool]: 형식별로 파일을 새로 썼는지 여부.
+    """
+    formats = parse_formats() if formats is None else formats
+    template = template or NodeTemplate.from_env()
+    structured = [fmt for fmt in formats if fmt != 'text']
+    if structured and template is None:
+        print(f"NODE_SECRET이 설정되지 않아 {', '.join(structured)} 출력을 건너뜁니다.")
+        structured = []
+
+    text_lines: List[str] = []
+    clash_lines: List[str] = ['proxies:']
+    links: List[str] = []
+    used_names: Dict[str, int] = {}
+    for node in nodes:
+        text_lines.append(node.text)
+        if not structured:
+            continue
+        endpoint = node.endpoint()
+        if endpoint is None:
+            continue
+        host, port = endpoint
+        name = f"{node.label} {host}:{port}".strip()
+        seen = used_names.get(name, 0)
+        used_names[name] = seen + 1
+        if seen:
+            name = f"{name} {seen + 1}"
+        if 'clash' in structured:
+            clash_lines.append(f"  - {_yaml_flow(clash_proxy(name, host, port, template))}")
+        if 'base64' in structured:
+            links.append(share_link(name, host, port, template))
+
+    written = {'text': write_lines_if_changed(text_path, text_lines)}
+    if 'clash' in structured:
+        written['clash'] = write_lines_if_changed(format_path(text_path, 'clash'), clash_lines)
+    if 'base64' in structured:
+        blob = base64.b64encode('\n'.join(links).encode('utf-8')).decode('ascii')
+        written['base64'] = write_text_if_changed(format_path(text_path, 'base64'), blob)
+    return written
+
+
+def parse_share_link(link: str) -> Optional[Dict[str, Any]]:
+    """
+    'trojan://' / 'vless://' 공유 링크를 Clash 항목과 같은 키(name, type, server, port)의 딕셔너리로 변환합니다.
+    지원하지 않는 링크나 주소/포트가 없는 링크는 None.
+    """
+    try:
+        parts = urlsplit(link.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    if parts.scheme not in SHARE_LINK_TYPES or not parts.hostname or port is None:
+        return None
+    return {'name': unquote(parts.fragment), 'type': parts.scheme, 'server': parts.hostname, 'port': port}
+
+
+def decode_subscription(text: str) -> List[Dict[str, Any]]:
+    """
+    구독 본문(base64로 인코딩된 공유 링크 목록 또는 평문 링크 목록)을 Clash 형식 항목들로 변환합니다.
+    base64로 읽을 수 없으면 빈 목록을 반환합니다.
+    """
+    body = text.strip()
+    if '://' not in body:
+        compact = ''.join(body.split()).replace('-', '+').replace('_', '/')
+        try:
+            body = base64.b64decode(compact + '=' * (-len(compact) % 4), validate=True).decode('utf-8')
+        except (ValueError, UnicodeDecodeError):
+            return []
+    proxies = []
+    for line in body.splitlines():
+        proxy = parse_share_link(line)
+        if proxy is not None:
+            proxies.append(proxy)
+    return proxies
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+
+from proxy_record import ip_to_int
+
+DEFAULT_SAMPLE_SIZE = 2
+# what to do with the rest of a group whose samples were all dead
+SKIP = 'skip'    # do not check them this run
+DEFER = 'defer'  # check them after every other group
+
+
+def group_key(row):
+    """Rows in the same /24 with the same provider (4th CSV column) share a group.
+    Hostname rows are never grouped."""
+    ip, port, provider = row[0].strip(), row[1].strip(), row[3].strip().lower()
+    if ip_to_int(ip) is None:
+        return ('host', f"{ip}:{port}")
+    return (ip.rsplit('.', 1)[0], provider)
+
+
+def group_rows(rows):
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(group_key(row), []).append(row)
+    return groups
+
+
+def _verdict(results):
+    """'live' if any sample is alive, 'dead' if every sample is dead, else 'unknown'
+    (a checker error says nothing about the proxies)."""
+    if not results:
+        return 'unknown', 0.0
+    alive = sum(1 for _, (line, error, _) in results if line)
+    dead = sum(1 for _, (line, error, _) in results if not line and not error)
+    if alive:
+        return 'live', alive / len(results)
+    if dead == len(results):
+        return 'dead', 0.0
+    return 'unknown', 0.0
+
+
+def schedule_checks(rows, check, known=(), sample_size=DEFAULT_SAMPLE_SIZE, dead_policy=SKIP,
+                    last_checked=None, score=None, budget=0):
+    """Check rows group by group, sample first.
+
+    check(rows) runs the checks and returns (row, result) pairs. Groups larger
+    than sample_size + 1 first check sample_size rows, least recently checked
+    first (last_checked(row) gives a timestamp, or None for never checked), so
+    every run samples different rows of a dead group and none is left out for
+    good. A known live result (e.g. a cache hit) settles a group without
+    sampling; known dead results do not, since they are the rows sampled
+    before. The rest of the groups with a live sample are checked next, then
+    groups whose samples only errored. Groups whose samples were all dead are
+    skipped or, with dead_policy='defer', checked last.
+
+    With score(row) (higher is better), groups go best mean score first in
+    every phase and rows best score first within a group; live groups with
+    equal means go best alive ratio first. A budget caps the number of checks
+    in that scheduled order: samples first, then the rest.
+
+    Returns (results, skipped_rows, stats)."""
+    groups = group_rows(rows)
+    if score is not None:
+        # stable sorts: equal scores keep input order
+        groups = OrderedDict((key, sorted(members, key=lambda row: -score(row)))
+                             for key, members in groups.items())
+        mean = {key: sum(map(score, members)) / len(members) for key, members in groups.items()}
+        groups = OrderedDict(sorted(groups.items(), key=lambda item: -mean[item[0]]))
+    evidence = {}
+    for row, result in known:
+        evidence.setdefault(group_key(row), []).append((row, result))
+
+    samples, rest = [], {}
+    for key, members in groups.items():
+        if len(members) <= sample_size + 1:
+            samples.extend(members)
+            continue
+        if _verdict(evidence.get(key, ()))[0] == 'live':
+            rest[key] = members
+            continue
+        picked = members[:sample_size]
+        if last_checked is not None:
+            # stable: rows never checked (or checked equally long ago) keep their order
+            picked = sorted(members, key=lambda row: last_checked(row) or 0)[:sample_size]
+        samples.extend(picked)
+        picked_ids = set(map(id, picked))
+        rest[key] = [row for row in members if id(row) not in picked_ids]
+
+    over_budget = []
+    if budget and len(samples) > budget:
+        samples, over_budget = samples[:budget], samples[budget:]
+    results = check(samples) if samples else []
+    for row, result in results:
+        evidence.setdefault(group_key(row), []).append((row, result))
+
+    live, unknown, dead = [], [], []
+    for key, members in rest.items():
+        verdict, ratio = _verdict(evidence.get(key, ()))
+        if verdict == 'live':
+            live.append((mean[key] if score is not None else 0.0, ratio, key, members))
+        elif verdict == 'dead':
+            dead.append(members)
+        else:
+            unknown.append(members)
+    # stable sort: equal scores and ratios keep the group order
+    live.sort(key=lambda item: (-item[0], -item[1]))
+
+    ordered = [row for _, _, _, members in live for row in members]
+    ordered += [row for members in unknown for row in members]
+    skipped = []
+    if dead_policy == DEFER:
+        ordered += [row for members in dead for row in members]
+    else:
+        skipped = [row for members in dead for row in members]
+
+    if budget:
+        room = max(0, budget - len(samples))
+        over_budget += ordered[room:]
+        ordered = ordered[:room]
+    if ordered:
+        results += check(ordered)
+    stats = {
+        'groups': len(groups),
+        'sampled': len(samples),
+        'live_groups': len(live),
+        'dead_groups': len(dead),
+        'skipped': len(skipped),
+        'over_budget': len(over_budget),
+    }
+    return results, skipped, stats
@@ -0,0 +1,73 @@
+import hashlib
+import json
+
+from error_log import CheckError, classify_message
+from output_sink import write_text_if_changed
+
+
+def parse_shard(spec):
+    """'i/n' -> (i, n) with 0 <= i < n."""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"invalid shard {spec!r}, expected i/n (e.g. 0/4)")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"invalid shard {spec!r}, need 0 <= i < n")
+    return index, count
+
+
+def shard_of(endpoint, count):
+    # a stable hash (not hash()) so every process and runner agrees on the split
+    digest = hashlib.blake2b(endpoint.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def partial_path(output_file, index, count):
+    return f"{output_file}.part{index}of{count}.jsonl"
+
+
+def write_partial(path, index, count, items):
+    """Write one shard's results: a header line, then one line per
+    (input position, row, (alive, error, latency_ms), cached) item."""
+    lines = [json.dumps({'shard': index, 'shards': count})]
+    for position, row, (alive, error, latency_ms), cached in items:
+        lines.append(json.dumps({
+            'i': position,
+            'row': list(row),
+            'alive': alive,
+            'error': str(error) if error else None,
+            'code': classify_message(error) if error else None,
+            'latency_ms': latency_ms,
+            'cached': cached,
+        }, ensure_ascii=False))
+    write_text_if_changed(path, '\n'.join(lines) + '\n')
+
+
+def read_partials(paths):
+    """Merge partial files into (row, result, cached) items in input order.
+
+    Returns (items, missing) where missing lists the shard indexes that no
+    file covered; a shard seen twice is an error rather than a silent dup."""
+    seen = {}
+    count = None
+    items = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if count is None:
+                count = header['shards']
+            elif header['shards'] != count:
+                raise ValueError(f"{path}: shard count {header['shards']} does not match {count}")
+            if header['shard'] in seen:
+                raise ValueError(f"{path}: shard {header['shard']} already merged from {seen[header['shard']]}")
+            seen[header['shard']] = path
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                error = CheckError(item['error'], item['code']) if item['error'] else None
+                items.append((item['i'], item['row'], (item['alive'], error, item['latency_ms']),
+                              item.get('cached', False)))
+    items.sort(key=lambda item: item[0])
+    missing = [i for i in range(count or 0) if i not in seen]
+    return [(row, result, cached) for _, row, result, cached in items], missing
@@ -0,0 +1,61 @@
+import asyncio
+import socket
+import ssl
+import time
+from collections import namedtuple
+
+# same SNI host the remote checker is asked to use in API_URL
+DEFAULT_SNI = 'speed.cloudflare.com'
+PROBE_TIMEOUT = 10
+
+ProbeResult = namedtuple('ProbeResult', ['ok', 'connect_ms', 'handshake_ms', 'error'])
+
+
+def make_context(verify=True, cafile=None):
+    # cafile lets a local stand-in TLS server with a self-signed cert pass verification
+    context = ssl.create_default_context(cafile=cafile)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def probe_tls(ip, port, sni=DEFAULT_SNI, timeout=PROBE_TIMEOUT, context=None):
+    """Open a TCP connection to ip:port and complete a TLS handshake for `sni`."""
+    context = context or make_context()
+    start = time.perf_counter()
+    try:
+        sock = socket.create_connection((ip, int(port)), timeout=timeout)
+    except OSError as e:
+        return ProbeResult(False, None, None, f"connect: {e}")
+    connected = time.perf_counter()
+    try:
+        with context.wrap_socket(sock, server_hostname=sni):
+            done = time.perf_counter()
+    except (ssl.SSLError, OSError) as e:
+        sock.close()
+        return ProbeResult(False, (connected - start) * 1000, None, f"tls: {e}")
+    return ProbeResult(True, (connected - start) * 1000, (done - connected) * 1000, None)
+
+
+async def probe_tls_async(ip, port, sni=DEFAULT_SNI, timeout=PROBE_TIMEOUT, context=None):
+    """asyncio version of probe_tls; needs StreamWriter.start_tls (Python 3.11+),
+    otherwise the blocking probe runs in the default executor."""
+    context = context or make_context()
+    if not hasattr(asyncio.StreamWriter, 'start_tls'):
+        return await asyncio.to_thread(probe_tls, ip, port, sni, timeout, context)
+
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, int(port)), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        return ProbeResult(False, None, None, f"connect: {str(e) or type(e).__name__}")
+    connected = time.perf_counter()
+    try:
+        await asyncio.wait_for(writer.start_tls(context, server_hostname=sni), timeout)
+        done = time.perf_counter()
+    except (ssl.SSLError, OSError, asyncio.TimeoutError) as e:
+        return ProbeResult(False, (connected - start) * 1000, None, f"tls: {str(e) or type(e).__name__}")
+    finally:
+        writer.close()
+    return ProbeResult(True, (connected - start) * 1000, (done - connected) * 1000, None)
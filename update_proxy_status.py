@@ -1,90 +1,705 @@
 import requests
+import argparse
+import asyncio
 import csv
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
+import threading
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-def check_proxy(row, api_url_template):
-    ip, port, country_code, company = row[0].strip(), row[1].strip(), row[2].strip(), row[3].strip()
-    api_url = api_url_template.format(ip=ip, port=port)
-    try:
-        response = requests.get(api_url, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-
-        proxyip = data.get("proxyip", "")
-        if isinstance(proxyip, bool):
-            status = proxyip
-        elif isinstance(proxyip, str):
-            status = proxyip.strip().lower() == "true"
-        else:
-            status = False
+from check_cache import CheckCache, DEFAULT_NEGATIVE_TTL, DEFAULT_TTL
+from checker_client import AsyncGate, CheckerClient, CircuitBreaker, CircuitOpenError
+from error_log import (CIRCUIT_OPEN, DEFAULT_MAX_AGE, DEFAULT_MAX_BYTES, DEFAULT_SAMPLES, JSON_DECODE, OTHER,
+                       CheckError, ErrorLog, classify)
+from health_history import DEFAULT_PATH as HEALTH_PATH, PRIOR_UPTIME, HealthHistory, prioritize
+import metrics
+from metrics import verbose_print
+from output_sink import write_lines_if_changed
+from scheduler import DEFAULT_SAMPLE_SIZE, SKIP, schedule_checks
+from shards import parse_shard, partial_path, read_partials, shard_of, write_partial
+from tls_probe import DEFAULT_SNI, PROBE_TIMEOUT, make_context, probe_tls, probe_tls_async
 
-        if status:
-            print(f"{ip}:{port} is ALIVE")
-            return (f"{ip}:{port}#{country_code} {company}", None)
-        else:
-            print(f"{ip}:{port} is DEAD")
-            return (None, None)
+DEFAULT_API_URL = 'https://p01--boiling-frame--kw6dd7bjv2nr.code.run/check?ip={ip}&host=speed.cloudflare.com&port={port}&tls=true'
+CHECK_TIMEOUT = 60
+THREAD_WORKERS = 50
+# async engine: number of in-flight checks sharing one keep-alive connection pool
+ASYNC_CONCURRENCY = 500
+# batch backend: endpoints per POST and batches in flight
+BATCH_SIZE = 50
+BATCH_CONCURRENCY = 4
+# replies meaning "this checker has no batch endpoint": fall back to one request per row
+BATCH_UNSUPPORTED_STATUS = {400, 404, 405, 415, 501}
+# batch URLs found not to take batches; remembered for the rest of the run so
+# every schedule phase does not probe them again
+_batchless_urls = set()
+
+# ports that are never worth checking (previously dropped only after a successful check)
+EXCLUDE_PORTS = '443,8080,2053,8443'
+
+def _env_list(name, default=''):
+    return {value.strip() for value in os.getenv(name, default).split(',') if value.strip()}
+
+def load_row_filter():
+    # comma separated env settings; an empty include list means "everything"
+    return {
+        'include_ports': _env_list('INCLUDE_PORTS'),
+        'exclude_ports': _env_list('EXCLUDE_PORTS', EXCLUDE_PORTS),
+        'include_countries': {c.upper() for c in _env_list('INCLUDE_COUNTRIES')},
+        'exclude_countries': {c.upper() for c in _env_list('EXCLUDE_COUNTRIES')},
+        'include_providers': {p.lower() for p in _env_list('INCLUDE_PROVIDERS')},
+        'exclude_providers': {p.lower() for p in _env_list('EXCLUDE_PROVIDERS')},
+    }
+
+def row_allowed(row, row_filter):
+    ip, port, country_code, company = parse_row(row)
+    country_code = country_code.upper()
+    company = company.lower()
+    if row_filter['include_ports'] and port not in row_filter['include_ports']:
+        return False
+    if port in row_filter['exclude_ports']:
+        return False
+    if row_filter['include_countries'] and country_code not in row_filter['include_countries']:
+        return False
+    if country_code in row_filter['exclude_countries']:
+        return False
+    # provider names match on a case-insensitive substring ("oracle" matches "Oracle Cloud")
+    if row_filter['include_providers'] and not any(p in company for p in row_filter['include_providers']):
+        return False
+    if any(p in company for p in row_filter['exclude_providers']):
+        return False
+    return True
+
+def filter_rows(rows, row_filter):
+    kept = [row for row in rows if row_allowed(row, row_filter)]
+    return kept, len(rows) - len(kept)
+
+def parse_row(row):
+    return row[0].strip(), row[1].strip(), row[2].strip(), row[3].strip()
+
+def endpoint_key(row):
+    return f"{row[0].strip()}:{row[1].strip()}"
+
+def interpret_proxyip(data):
+    proxyip = data.get("proxyip", "")
+    if isinstance(proxyip, bool):
+        return proxyip
+    elif isinstance(proxyip, str):
+        return proxyip.strip().lower() == "true"
+    return False
+
+def build_result(ip, port, country_code, company, status, latency_ms=None):
+    # results are (alive line or None, error or None, round-trip ms or None)
+    if status:
+        verbose_print(f"{ip}:{port} is ALIVE")
+        return (f"{ip}:{port}#{country_code} {company}", None, latency_ms)
+    verbose_print(f"{ip}:{port} is DEAD")
+    return (None, None, None)
+
+def cached_result(row, cached):
+    # the cache keeps only (alive, latency_ms); the line is built from the current row's label
+    alive, latency_ms = cached
+    if not alive:
+        return (None, None, None)
+    ip, port, country_code, company = parse_row(row)
+    return (f"{ip}:{port}#{country_code} {company}", None, latency_ms)
+
+def make_client(api_url_template, max_concurrency):
+    breaker = CircuitBreaker(
+        threshold=int(os.getenv('BREAKER_THRESHOLD', 10)),
+        cooldown=float(os.getenv('BREAKER_COOLDOWN', 30)),
+    )
+    return CheckerClient(
+        api_url_template,
+        max_concurrency=max_concurrency,
+        max_retries=int(os.getenv('CHECK_RETRIES', 2)),
+        max_timeout=CHECK_TIMEOUT,
+        # first requests wait this long, not CHECK_TIMEOUT, until latencies are measured
+        initial_timeout=float(os.getenv('CHECK_INITIAL_TIMEOUT', 5)),
+        breaker=breaker,
+    )
+
+def check_proxy(row, api_url_template, client=None):
+    ip, port, country_code, company = parse_row(row)
+    client = client or make_client(api_url_template, 1)
+    try:
+        data, elapsed = client.get_json(ip, port)
+        latency_ms = elapsed * 1000
+        return build_result(ip, port, country_code, company, interpret_proxyip(data), latency_ms)
+    except CircuitOpenError as e:
+        return (None, CheckError(f"Error checking {ip}:{port}: {e}", CIRCUIT_OPEN), None)
     except requests.exceptions.RequestException as e:
-        error_message = f"Error checking {ip}:{port}: {e}"
-        print(error_message)
-        return (None, error_message)
+        error_message = CheckError(f"Error checking {ip}:{port}: {e}", classify(e))
+        verbose_print(error_message)
+        return (None, error_message, None)
     except ValueError as ve:
-        error_message = f"Error parsing JSON for {ip}:{port}: {ve}"
-        print(error_message)
-        return (None, error_message)
+        error_message = CheckError(f"Error parsing JSON for {ip}:{port}: {ve}", JSON_DECODE)
+        verbose_print(error_message)
+        return (None, error_message, None)
 
-def main():
-    input_file = os.getenv('IP_FILE', 'proxy.txt')
-    output_file = 'proxy_updated.txt'
-    error_file = 'errorproxy.txt'
-    api_url_template = os.getenv('API_URL', 'https://p01--boiling-frame--kw6dd7bjv2nr.code.run/check?ip={ip}&host=speed.cloudflare.com&port={port}&tls=true')
+def run_thread_checks(rows, api_url_template, max_workers=THREAD_WORKERS):
+    # one client per run: shared keep-alive session, breaker and adaptive limits
+    client = make_client(api_url_template, max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(check_proxy, row, api_url_template, client): row for row in rows}
+        results = [(futures[future], future.result()) for future in as_completed(futures)]
+    report_breaker(client)
+    return results
 
-    alive_proxies = []
-    error_logs = []
+async def check_proxy_async(client, session, gate, row):
+    import aiohttp
 
+    ip, port, country_code, company = parse_row(row)
     try:
-        with open(input_file, "r") as f:
-            reader = csv.reader(f)
-            rows = list(reader)
-    except FileNotFoundError:
+        data, elapsed = await client.get_json_async(session, ip, port, gate)
+        latency_ms = elapsed * 1000
+        return build_result(ip, port, country_code, company, interpret_proxyip(data), latency_ms)
+    except CircuitOpenError as e:
+        return (None, CheckError(f"Error checking {ip}:{port}: {e}", CIRCUIT_OPEN), None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # asyncio.TimeoutError has an empty message, so fall back to the class name
+        error_message = CheckError(f"Error checking {ip}:{port}: {str(e) or type(e).__name__}", classify(e))
+        verbose_print(error_message)
+        return (None, error_message, None)
+    except ValueError as ve:
+        error_message = CheckError(f"Error parsing JSON for {ip}:{port}: {ve}", JSON_DECODE)
+        verbose_print(error_message)
+        return (None, error_message, None)
+
+async def _run_async_checks(rows, api_url_template, concurrency):
+    import aiohttp  # only needed for CHECK_ENGINE=async
+
+    client = make_client(api_url_template, concurrency)
+    gate = AsyncGate(client.limits)
+    # one session = one keep-alive pool to the checker host, sized to the concurrency
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [check_proxy_async(client, session, gate, row) for row in rows]
+        results = list(zip(rows, await asyncio.gather(*tasks)))
+    report_breaker(client)
+    return results
+
+def run_async_checks(rows, api_url_template, concurrency=ASYNC_CONCURRENCY):
+    return asyncio.run(_run_async_checks(rows, api_url_template, concurrency))
+
+def report_breaker(client):
+    if client.breaker.is_open:
+        print(f"Checker circuit breaker is OPEN ({client.breaker.failures} consecutive failures); "
+              f"remaining checks were skipped.")
+
+def probe_settings():
+    return {
+        'sni': os.getenv('TLS_SNI', DEFAULT_SNI),
+        'timeout': float(os.getenv('PROBE_TIMEOUT', PROBE_TIMEOUT)),
+        'context': make_context(verify=os.getenv('TLS_VERIFY', '1') != '0',
+                                cafile=os.getenv('TLS_CAFILE') or None),
+    }
+
+def probe_result(row, probe):
+    ip, port, country_code, company = parse_row(row)
+    if not probe.ok:
+        # a failed connect/handshake means the proxy is dead, not that the check errored
+        return build_result(ip, port, country_code, company, False)
+    verbose_print(f"{ip}:{port} connect {probe.connect_ms:.0f} ms, TLS handshake {probe.handshake_ms:.0f} ms")
+    return build_result(ip, port, country_code, company, True, probe.connect_ms + probe.handshake_ms)
+
+def check_proxy_tls(row, settings):
+    ip, port, _, _ = parse_row(row)
+    return probe_result(row, probe_tls(ip, port, **settings))
+
+def run_thread_probes(rows, settings, max_workers=THREAD_WORKERS):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(check_proxy_tls, row, settings): row for row in rows}
+        return [(futures[future], future.result()) for future in as_completed(futures)]
+
+async def check_proxy_tls_async(semaphore, row, settings):
+    ip, port, _, _ = parse_row(row)
+    async with semaphore:
+        probe = await probe_tls_async(ip, port, **settings)
+    return probe_result(row, probe)
+
+async def _run_async_probes(rows, settings, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [check_proxy_tls_async(semaphore, row, settings) for row in rows]
+    return list(zip(rows, await asyncio.gather(*tasks)))
+
+def run_async_probes(rows, settings, concurrency=ASYNC_CONCURRENCY):
+    return asyncio.run(_run_async_probes(rows, settings, concurrency))
+
+def batch_url(api_url_template):
+    # the single-check URL without its {ip}/{port} parameters, e.g.
+    # /check?ip={ip}&host=h&port={port}&tls=true -> /check?host=h&tls=true
+    parts = urlsplit(api_url_template)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if '{ip}' not in value and '{port}' not in value]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def batch_payload(batch):
+    return [{'ip': ip, 'port': int(port) if port.isdigit() else port}
+            for ip, port, _, _ in map(parse_row, batch)]
+
+def match_batch_reply(batch, data):
+    """Per-row reply items (None where the reply has nothing for a row), or None
+    if data is not a batch reply at all. Items carrying ip/port are matched by
+    endpoint, anything else by position."""
+    if isinstance(data, dict):
+        data = data.get('results')
+    if not isinstance(data, list):
+        return None
+    if data and all(isinstance(item, dict) and 'ip' in item and 'port' in item for item in data):
+        by_endpoint = {f"{item['ip']}:{item['port']}": item for item in data}
+        return [by_endpoint.get(endpoint_key(row)) for row in batch]
+    if len(data) != len(batch):
+        return None
+    return [item if isinstance(item, dict) else None for item in data]
+
+def batch_item_result(row, item):
+    ip, port, country_code, company = parse_row(row)
+    if item is None:
+        return (None, CheckError(f"Error checking {ip}:{port}: no result in batch reply", JSON_DECODE), None)
+    if item.get('error'):
+        return (None, CheckError(f"Error checking {ip}:{port}: {item['error']}", OTHER), None)
+    # the round trip covers the whole batch, so only a per-item time from the checker is a latency
+    latency_ms = item.get('latency_ms')
+    if isinstance(latency_ms, bool) or not isinstance(latency_ms, (int, float)):
+        latency_ms = None
+    return build_result(ip, port, country_code, company, interpret_proxyip(item), latency_ms)
+
+def check_batch(batch, url, client):
+    """(row, result) pairs for one batch, or None if the checker does not do batches.
+    Only a status in BATCH_UNSUPPORTED_STATUS or an unusable reply means "no batches";
+    any other 5xx is retried as overload and, if it persists, fails the batch's rows
+    like single checks would, since falling back would put the same load on a
+    struggling checker one request per row."""
+    try:
+        data, _ = client.post_json(url, batch_payload(batch))
+    except CircuitOpenError as e:
+        return [(row, (None, CheckError(f"Error checking {endpoint_key(row)}: {e}", CIRCUIT_OPEN), None))
+                for row in batch]
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code in BATCH_UNSUPPORTED_STATUS:
+            return None
+        return [(row, (None, CheckError(f"Error checking {endpoint_key(row)}: {e}", classify(e)), None))
+                for row in batch]
+    except requests.exceptions.RequestException as e:
+        return [(row, (None, CheckError(f"Error checking {endpoint_key(row)}: {e}", classify(e)), None))
+                for row in batch]
+    except ValueError:
+        return None
+    items = match_batch_reply(batch, data)
+    if items is None:
+        return None
+    return [(row, batch_item_result(row, item)) for row, item in zip(batch, items)]
+
+def run_batch_checks(rows, api_url_template, batch_size=BATCH_SIZE, concurrency=BATCH_CONCURRENCY):
+    """POST rows to the checker batch_size endpoints at a time (BATCH_API_URL, by
+    default the API_URL without its {ip}/{port} parameters). The first batch
+    goes alone; if the checker turns out not to take batches every row is
+    checked with the single-item API_URL instead, in this call and later ones."""
+    if not rows:
+        return []
+    url = os.getenv('BATCH_API_URL') or batch_url(api_url_template)
+    if url in _batchless_urls:
+        return run_thread_checks(rows, api_url_template)
+    client = make_client(url, concurrency)
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    results = check_batch(batches[0], url, client)
+    if results is None:
+        _batchless_urls.add(url)
+        print(f"Checker at {url} does not accept batches; checking {len(rows)} rows one by one.")
+        return run_thread_checks(rows, api_url_template)
+    unsupported = threading.Event()
+    fallback = []
+
+    def run_batch(batch):
+        if unsupported.is_set():
+            return None
+        batch_results = check_batch(batch, url, client)
+        if batch_results is None:
+            unsupported.set()
+        return batch_results
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(run_batch, batch): batch for batch in batches[1:]}
+        for future in as_completed(futures):
+            batch_results = future.result()
+            if batch_results is None:
+                fallback.extend(futures[future])
+            else:
+                results.extend(batch_results)
+    report_breaker(client)
+    if fallback:
+        _batchless_urls.add(url)
+        print(f"Checker at {url} stopped accepting batches; checking {len(fallback)} rows one by one.")
+        results.extend(run_thread_checks(fallback, api_url_template))
+    return results
+
+def run_checks(rows, api_url_template, backend='api', engine='thread', concurrency=None):
+    # backend: 'api' asks the remote checker, 'batch' asks it BATCH_SIZE rows per request,
+    # 'tls' probes ip:port directly
+    if backend == 'batch':
+        # a handful of large requests: the thread engine is enough for either setting
+        return run_batch_checks(rows, api_url_template,
+                                batch_size=int(os.getenv('BATCH_SIZE', BATCH_SIZE)),
+                                concurrency=int(os.getenv('BATCH_CONCURRENCY', BATCH_CONCURRENCY)))
+    if engine == 'async':
+        concurrency = concurrency or ASYNC_CONCURRENCY
+        if backend == 'tls':
+            return run_async_probes(rows, probe_settings(), concurrency)
+        return run_async_checks(rows, api_url_template, concurrency)
+    concurrency = concurrency or THREAD_WORKERS
+    if backend == 'tls':
+        return run_thread_probes(rows, probe_settings(), concurrency)
+    return run_thread_checks(rows, api_url_template, concurrency)
+
+def rank_alive(all_results, top_per_country=0, latency_tag=False, scores=None):
+    """Alive lines best health score first when scores are given, then fastest
+    first (unmeasured last, then input order), at most top_per_country per
+    country code when it is set."""
+    scores = scores or {}
+    ranked = sorted(
+        ((row, alive, latency_ms) for row, (alive, _, latency_ms) in all_results if alive),
+        key=lambda item: (-scores.get(endpoint_key(item[0]), PRIOR_UPTIME), item[2] is None, item[2] or 0),
+    )
+    per_country = defaultdict(int)
+    lines = []
+    for row, alive, latency_ms in ranked:
+        country_code = row[2].strip()
+        if top_per_country and per_country[country_code] >= top_per_country:
+            continue
+        per_country[country_code] += 1
+        if latency_tag and latency_ms is not None:
+            alive = f"{alive} {latency_ms:.0f}ms"
+        lines.append(alive)
+    return lines
+
+def open_history():
+    # HEALTH_HISTORY='' disables the history and the score ordering
+    path = os.getenv('HEALTH_HISTORY', HEALTH_PATH)
+    if not path:
+        return None
+    return HealthHistory(
+        path,
+        retention=float(os.getenv('HISTORY_RETENTION_DAYS', 14)) * 24 * 3600,
+        half_life=float(os.getenv('HISTORY_HALF_LIFE_HOURS', 24)) * 3600,
+    )
+
+def record_check_metrics(stage_metrics, results):
+    # counted after the run so the workers never contend on the metrics lock
+    for _, (alive, error, latency_ms) in results:
+        stage_metrics.add('checks_error' if error else 'checks_alive' if alive else 'checks_dead')
+        if latency_ms is not None:
+            stage_metrics.observe('check_latency_ms', latency_ms)
+    stage_metrics.add('rows_checked', len(results))
+
+def check_input(input_file, api_url_template, backend, engine, shard=None):
+    """Load, filter and check the rows (only those of shard (i, n) when given).
+    Returns (input position, row, result, cached) items in input order, or None if the file is missing."""
+    stage_metrics = metrics.current()
+    with stage_metrics.timer('parse'):
+        try:
+            with open(input_file, "r") as f:
+                reader = csv.reader(f)
+                rows = list(reader)
+        except FileNotFoundError:
+            print(f"File {input_file} not found.")
+            return None
+
+        stage_metrics.add('rows_processed', len(rows))
+        rows = [row for row in rows if len(row) >= 4]
+        rows, skipped = filter_rows(rows, load_row_filter())
+        stage_metrics.add('rows_filtered_out', skipped)
+        # positions are taken before sharding so partial results merge back in input order
+        position = {}
+        for i, row in enumerate(rows):
+            position.setdefault(endpoint_key(row), i)
+        print(f"Pre-check filter: {len(rows)} rows to check, {skipped} checks avoided.")
+        if shard is not None:
+            index, count = shard
+            rows = [row for row in rows if shard_of(endpoint_key(row), count) == index]
+            print(f"Shard {index}/{count}: {len(rows)} rows.")
+
+    # CHECK_CACHE='' disables the result cache
+    cache_path = os.getenv('CHECK_CACHE', 'proxy_check_cache.sqlite3')
+    cache = None
+    cached_results = []
+    if cache_path:
+        cache = CheckCache(
+            cache_path,
+            ttl=float(os.getenv('CACHE_TTL', DEFAULT_TTL)),
+            negative_ttl=float(os.getenv('CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL)),
+        )
+        with stage_metrics.timer('cache'):
+            cached, rows = cache.split_rows(rows, endpoint_key)
+            cached_results = [(row, cached_result(row, outcome)) for row, outcome in cached]
+        stage_metrics.add('cache_hits', len(cached_results))
+        print(f"Result cache: {len(cached_results)} fresh entries reused, {len(rows)} rows to re-check.")
+
+    # proven-good proxies are checked first; CHECK_BUDGET caps the checks in the order they are scheduled
+    history = open_history()
+    scores = {}
+    if history is not None:
+        with stage_metrics.timer('history'):
+            scores = history.scores()
+        print(f"Health history: {len(scores)} endpoints scored.")
+    budget = int(os.getenv('CHECK_BUDGET', 0))
+
+    def score(row):
+        return scores.get(endpoint_key(row), PRIOR_UPTIME)
+
+    concurrency = int(os.getenv('CHECK_CONCURRENCY', 0)) or None
+
+    def check(batch):
+        return run_checks(batch, api_url_template, backend, engine, concurrency)
+
+    with stage_metrics.timer('check'):
+        # CHECK_SCHEDULE=flat checks every row; 'subnet' samples each /24+provider group first
+        if os.getenv('CHECK_SCHEDULE', 'subnet') == 'flat':
+            rows, over_budget = prioritize(rows, scores, endpoint_key, budget)
+            stage_metrics.add('rows_over_budget', len(over_budget))
+            if over_budget:
+                print(f"Check budget: {len(over_budget)} lowest-scored rows skipped.")
+            results = check(rows)
+        else:
+            # stale cache entries still tell when a row was last checked, so samples rotate
+            last_checked = {}
+            if cache is not None:
+                last_checked = {endpoint: checked_at for endpoint, _, checked_at, _ in cache.entries()}
+            results, deferred, stats = schedule_checks(
+                rows, check, known=cached_results,
+                sample_size=int(os.getenv('SCHEDULE_SAMPLE', DEFAULT_SAMPLE_SIZE)),
+                dead_policy=os.getenv('DEAD_GROUPS', SKIP),
+                last_checked=lambda row: last_checked.get(endpoint_key(row)),
+                score=score, budget=budget,
+            )
+            stage_metrics.add('rows_skipped_dead_group', len(deferred))
+            stage_metrics.add('rows_over_budget', stats['over_budget'])
+            print(f"Scheduler: {stats['groups']} groups, {stats['sampled']} sample checks, "
+                  f"{stats['dead_groups']} dead groups, {len(deferred)} checks avoided.")
+            if stats['over_budget']:
+                print(f"Check budget: {stats['over_budget']} rows at the end of the schedule skipped.")
+    record_check_metrics(stage_metrics, results)
+
+    if cache is not None:
+        with stage_metrics.timer('cache'):
+            cache.store_many((endpoint_key(row), result) for row, result in results)
+            cache.close()
+    if history is not None:
+        with stage_metrics.timer('history'):
+            history.append((endpoint_key(row), result) for row, result in results)
+
+    # input order breaks latency ties (and orders unmeasured cache hits)
+    items = [(position[endpoint_key(row)], row, result, True) for row, result in cached_results]
+    items += [(position[endpoint_key(row)], row, result, False) for row, result in results]
+    return sorted(items, key=lambda item: item[0])
+
+def iter_input_rows(input_file):
+    # lazily, one row at a time, instead of reading the whole list up front
+    with open(input_file, 'r', newline='') as f:
+        yield from csv.reader(f)
+
+def stream_checks(input_file, api_url_template, backend, output_file, error_log):
+    """Check rows as they are read, with a bounded number of checks in flight.
+
+    Alive lines are appended (and flushed) to <output_file>.partial as they
+    complete and errors go straight into the error log, so memory does not
+    grow with the input and a killed run leaves its alive proxies behind.
+    Only alive results are kept for the final fastest-first ranking.
+    Returns those (row, result) pairs, or None if the input is missing."""
+    if not os.path.exists(input_file):
         print(f"File {input_file} not found.")
-        return
+        return None
+    stage_metrics = metrics.current()
+    row_filter = load_row_filter()
+    workers = int(os.getenv('CHECK_CONCURRENCY', 0)) or THREAD_WORKERS
+    max_in_flight = int(os.getenv('STREAM_IN_FLIGHT', workers * 4))
+    cache_path = os.getenv('CHECK_CACHE', 'proxy_check_cache.sqlite3')
+    cache = CheckCache(
+        cache_path,
+        ttl=float(os.getenv('CACHE_TTL', DEFAULT_TTL)),
+        negative_ttl=float(os.getenv('CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL)),
+    ) if cache_path else None
+    # outcomes are recorded, but rows are checked in input order (they are not all known up front)
+    history = open_history()
+    partial_file = output_file + '.partial'
+    alive_results = []
+    to_store = []
 
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        futures = {executor.submit(check_proxy, row, api_url_template): row for row in rows if len(row) >= 4}
+    def flush():
+        if cache is not None:
+            cache.store_many(to_store)
+        if history is not None:
+            history.append(to_store)
+        to_store.clear()
 
-    for future in as_completed(futures):
-        alive, error = future.result()
+    def handle(row, result, cached=False):
+        alive, error, _ = result
+        error_log.record_result(alive, error, cached)
         if alive:
-            ip_port_country_company = alive.split("#")
-            ip_port = ip_port_country_company[0].split(":")
-            port = ip_port[1]
-            if port not in ["443", "8080", "2053", "8443"]: # port가 443 또는 8080이 아닌 경우만 추가
-                alive_proxies.append(alive)
-        if error:
-            error_logs.append(f"{datetime.now()} - {error}")
+            # only what rank_alive needs is kept
+            alive_results.append((row[:3], result))
+            sink.write(alive + '\n')
+            sink.flush()
+        if not cached:
+            to_store.append((endpoint_key(row), result))
+            stage_metrics.add('rows_checked')
+            stage_metrics.add('checks_error' if error else 'checks_alive' if alive else 'checks_dead')
+            if result[2] is not None:
+                stage_metrics.observe('check_latency_ms', result[2])
+        if len(to_store) >= 500:
+            flush()
+
+    if backend == 'tls':
+        settings = probe_settings()
+        check = lambda row: check_proxy_tls(row, settings)
+    else:
+        # rows arrive one at a time here, so the batch backend checks them singly too
+        client = make_client(api_url_template, workers)
+        check = lambda row: check_proxy(row, api_url_template, client)
 
     try:
-        with open(output_file, "w") as f:
-            for proxy_info in alive_proxies:
-                f.write(proxy_info + "\n")
+        rows = iter_input_rows(input_file)
+        with open(partial_file, 'w', encoding='utf-8') as sink, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for row in rows:
+                stage_metrics.add('rows_processed')
+                if len(row) < 4 or not row_allowed(row, row_filter):
+                    stage_metrics.add('rows_filtered_out')
+                    continue
+                cached = cache.lookup(endpoint_key(row)) if cache is not None else None
+                if cached is not None:
+                    stage_metrics.add('cache_hits')
+                    handle(row, cached_result(row, cached), cached=True)
+                    continue
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle(pending.pop(future), future.result())
+                pending[executor.submit(check, row)] = row
+            for future in as_completed(pending):
+                handle(pending[future], future.result())
+    finally:
+        flush()
+        if cache is not None:
+            cache.close()
+
+    if backend != 'tls':
+        report_breaker(client)
+    return alive_results
+
+def tally_results(items):
+    """ErrorLog over (row, result, cached) items; cache hits do not count toward the verdict."""
+    error_log = ErrorLog(samples=int(os.getenv('ERROR_SAMPLES', DEFAULT_SAMPLES)))
+    for _, (alive, error, _), cached in items:
+        error_log.record_result(alive, error, cached)
+    return error_log
+
+def write_outputs(all_results, output_file, error_file, error_log):
+
+    # clients take the first entries, so the most stable, then fastest, proxies go first
+    history = open_history()
+    alive_proxies = rank_alive(all_results,
+                               top_per_country=int(os.getenv('TOP_PER_COUNTRY', 0)),
+                               latency_tag=os.getenv('LATENCY_TAG') == '1',
+                               scores=history.scores() if history is not None else None)
+
+    try:
+        with metrics.current().timer('write'):
+            written = write_lines_if_changed(output_file, alive_proxies)
+        if not written:
+            print(f"{output_file} is unchanged; not rewritten.")
     except Exception as e:
         print(f"Error writing to {output_file}: {e}")
-        return
+        return False
 
-    if error_logs:
+    # one aggregated JSON line per run; the file rotates by size or age
+    try:
+        error_log.write(error_file,
+                        max_bytes=int(os.getenv('ERROR_LOG_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                        max_age=timedelta(days=float(os.getenv('ERROR_LOG_MAX_DAYS', DEFAULT_MAX_AGE.days))))
+        summary = error_log.summary()
+        print(f"Run verdict: {summary['verdict']} (alive {summary['alive']}, dead {summary['dead']}, "
+              f"errors {summary['errors']} {summary['counts']}, cache hits {summary['cached']}); "
+              f"logged in {error_file}.")
+    except Exception as e:
+        print(f"Error writing to {error_file}: {e}")
+        return True
+
+    print(f"Alive proxies (after the pre-check filter) have been written to {output_file}.")
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check proxy.txt rows and write the alive ones to proxy_updated.txt.")
+    parser.add_argument('--shard', metavar='I/N',
+                        help="check only shard I of N (0-based, split by a hash of ip:port) and write partial results")
+    parser.add_argument('--partial', metavar='PATH',
+                        help="partial result file for --shard (default proxy_updated.txt.partIofN.jsonl)")
+    parser.add_argument('--merge', nargs='+', metavar='PARTIAL',
+                        help="merge partial result files into proxy_updated.txt and the error log instead of checking")
+    parser.add_argument('--stream', action='store_true', default=os.getenv('CHECK_STREAM') == '1',
+                        help="read and check rows lazily with bounded in-flight checks (thread engine, "
+                             "no scheduler/sharding; same as CHECK_STREAM=1)")
+    parser.add_argument('--verbose', action='store_true',
+                        help="print one line per checked row (same as VERBOSE=1)")
+    args = parser.parse_args(argv)
+    if args.stream and (args.shard or args.merge):
+        parser.error("--stream cannot be combined with --shard or --merge")
+    if args.verbose:
+        metrics.set_verbose(True)
+
+    # the per-stage timings and counters go to METRICS_FILE (run_metrics.json) at the end
+    with metrics.stage('update_proxy_status'):
+        run(parser, args)
+    metrics.write_summary()
+
+def run(parser, args):
+    input_file = os.getenv('IP_FILE', 'proxy.txt')
+    output_file = 'proxy_updated.txt'
+    error_file = os.getenv('ERROR_LOG', 'errorproxy.jsonl')
+    api_url_template = os.getenv('API_URL', DEFAULT_API_URL)
+    engine = os.getenv('CHECK_ENGINE', 'thread')
+    backend = os.getenv('CHECK_BACKEND', 'api')
+
+    if args.merge:
         try:
-            with open(error_file, "w") as f:
-                for error in error_logs:
-                    f.write(error + "\n")
-            print(f"Errors have been logged in {error_file}.")
-        except Exception as e:
-            print(f"Error writing to {error_file}: {e}")
+            items, missing = read_partials(args.merge)
+        except (ValueError, OSError) as e:
+            parser.error(str(e))
+        if missing:
+            print(f"Warning: no partial results for shard(s) {missing}; their proxies are left out.")
+        print(f"Merged {len(items)} results from {len(args.merge)} partial file(s).")
+        write_outputs([(row, result) for row, result, _ in items], output_file, error_file, tally_results(items))
+        return
+
+    if args.stream:
+        error_log = ErrorLog(samples=int(os.getenv('ERROR_SAMPLES', DEFAULT_SAMPLES)))
+        alive_results = stream_checks(input_file, api_url_template, backend, output_file, error_log)
+        if alive_results is None:
             return
+        if write_outputs(alive_results, output_file, error_file, error_log):
+            # the complete, ranked list is in place; the crash-safety copy is no longer needed
+            os.remove(output_file + '.partial')
+        return
+
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        parser.error(str(e))
+    items = check_input(input_file, api_url_template, backend, engine, shard)
+    if items is None:
+        return
+
+    if shard is not None:
+        partial = args.partial or partial_path(output_file, *shard)
+        write_partial(partial, shard[0], shard[1], items)
+        print(f"Partial results for shard {shard[0]}/{shard[1]} have been written to {partial}.")
+        return
 
-    print(f"Alive proxies (excluding ports 443 and 8080) have been appended to {output_file}.") # 메시지 변경
+    items = [(row, result, cached) for _, row, result, cached in items]
+    write_outputs([(row, result) for row, result, _ in items], output_file, error_file, tally_results(items))
 
 if __name__ == "__main__":
     main()